@@ -0,0 +1,445 @@
+"""디스코드/유튜브 없이 main.py 전체 흐름을 돌려보는 오프라인 벤치마크
+
+실제 main.py의 SearchModal, SongSelectView, GuildPlayer, PlayManager, QueueDB를 그대로 쓰고
+바깥쪽만 가짜로 바꾼다.
+  - yt-dlp / YoutubeSearch: 정해진 지연시간 후 항상 같은 결과를 돌려주는 스텁
+  - FFmpeg 소스: 아무것도 하지 않는 소스 (곡 길이만큼 지나면 after 콜백 호출)
+  - 길드/유저/메시지/인터랙션/음성 클라이언트: 필요한 속성만 있는 가짜 객체
+
+N개 서버 x M명이 검색/링크 요청을 보내고, 처리량, 첫 소리까지 걸린 시간(TTFA),
+이벤트 루프 지연, 메모리를 출력한다.
+
+    python benchmarks/harness.py --guilds 50 --users 4 --requests 5
+    python benchmarks/harness.py --guilds 200 --extract-latency 0.5 --track-seconds 2
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Stats:
+    def __init__(self):
+        self.requests = 0
+        self.request_seconds = []
+        self.errors = []
+        self.player_edits = 0
+        self.tracks_started = 0
+        self.rejected_searches = 0
+
+    def check_embed(self, embed):
+        title = getattr(embed, 'title', None)
+        if isinstance(title, str) and title.startswith('❌'):
+            self.errors.append(str(getattr(embed, 'description', None) or title))
+
+
+stats = Stats()
+
+
+# 가짜 yt-dlp / YoutubeSearch
+class FakeYoutubeDL:
+    latency = 0.2
+    track_seconds = 1.0
+
+    def extract_info(self, url, download=False):
+        time.sleep(self.latency)  # 실제 yt-dlp처럼 executor 스레드를 막음
+        video_id = url.rsplit('=', 1)[-1][-11:]
+        return {
+            'id': video_id,
+            'extractor_key': 'Youtube',
+            'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+            'title': f"Track {video_id}",
+            'duration': self.track_seconds,
+            'duration_string': f"0:{int(self.track_seconds):02d}",
+            'uploader': 'bench',
+            'thumbnail': None,
+            'url': f"https://stream.invalid/{video_id}.webm",
+            'acodec': 'opus',
+        }
+
+
+class FakeYoutubeSearch:
+    latency = 0.1
+
+    def __init__(self, query, max_results=5):
+        time.sleep(self.latency)  # 실제 라이브러리도 이벤트 루프에서 동기로 호출됨
+        self.results = [
+            {
+                'title': f"{query} #{i}",
+                'duration': '0:01',
+                'channel': 'bench',
+                'url_suffix': f"/watch?v={abs(hash((query, i))) % 10 ** 11:011d}",
+            }
+            for i in range(max_results)
+        ]
+
+    def to_dict(self):
+        return self.results
+
+
+class FakeSource:
+    def cleanup(self):
+        pass
+
+
+async def fake_create_audio_source(stream_url, acodec, gain_db, before_options=None):
+    return FakeSource()
+
+
+# 가짜 디스코드 객체
+class FakeVoiceClient:
+    def __init__(self, guild, channel):
+        self.guild = guild
+        self.channel = channel
+        self.source = None
+        self.connected = True
+        self.timer = None
+        self.after = None
+
+    def play(self, source, after=None):
+        if self.is_playing():
+            raise Exception("Already playing audio.")
+        stats.tracks_started += 1
+        self.source = source
+        self.after = after
+        # 실제 음성 스레드처럼 다른 스레드에서 after 콜백 호출
+        self.timer = threading.Timer(FakeYoutubeDL.track_seconds, self._finish)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _finish(self, error=None):
+        self.timer = None
+        if self.after:
+            self.after(error)
+
+    def stop(self):
+        if self.timer:
+            self.timer.cancel()
+            threading.Thread(target=self._finish, daemon=True).start()
+
+    def is_playing(self):
+        return self.timer is not None
+
+    def is_paused(self):
+        return False
+
+    def is_connected(self):
+        return self.connected
+
+    async def disconnect(self, force=False):
+        self.connected = False
+        self.stop()
+        if self.guild.voice_client is self:
+            self.guild.voice_client = None
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild, channel_id):
+        self.guild = guild
+        self.id = channel_id
+        self.members = []
+        self.mention = f"<#{channel_id}>"
+
+    async def connect(self, timeout=20.0, reconnect=True):
+        if self.guild.voice_client:
+            raise Exception("Already connected to a voice channel.")
+        await asyncio.sleep(0.05)  # 음성 서버 핸드셰이크
+        self.guild.voice_client = FakeVoiceClient(self.guild, self)
+        return self.guild.voice_client
+
+
+class FakeMessage:
+    next_id = 1
+
+    def __init__(self, guild, channel):
+        self.id = FakeMessage.next_id
+        FakeMessage.next_id += 1
+        self.guild = guild
+        self.channel = channel
+        self.embeds = []
+        self.view = None
+
+    async def edit(self, **kwargs):
+        stats.player_edits += 1
+        if kwargs.get('embed'):
+            stats.check_embed(kwargs['embed'])
+            self.embeds = [kwargs['embed']]
+        self.view = kwargs.get('view', self.view)
+        return self
+
+    async def fetch(self):
+        return self
+
+    async def delete(self):
+        pass
+
+
+class FakeTextChannel:
+    def __init__(self, guild, channel_id):
+        self.guild = guild
+        self.id = channel_id
+
+    def get_partial_message(self, message_id):
+        return self.guild.player_message
+
+    async def fetch_message(self, message_id):
+        return self.guild.player_message
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.voice_client = None
+        self.text_channel = FakeTextChannel(self, guild_id * 10 + 1)
+        self.voice_channel = FakeVoiceChannel(self, guild_id * 10 + 2)
+        self.player_message = FakeMessage(self, self.text_channel)
+
+    def get_channel(self, channel_id):
+        return {c.id: c for c in (self.text_channel, self.voice_channel)}.get(channel_id)
+
+
+class FakeUser:
+    bot = False
+
+    def __init__(self, user_id, guild):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.display_name = self.name
+        self.mention = f"<@{user_id}>"
+        self.voice = SimpleNamespace(channel=guild.voice_channel)
+
+    def __str__(self):
+        return self.name
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self):
+        return self.done
+
+    async def defer(self, ephemeral=False):
+        self.done = True
+
+    async def send_message(self, content=None, **kwargs):
+        self.done = True
+        if kwargs.get('embed'):
+            stats.check_embed(kwargs['embed'])
+
+    async def edit_message(self, **kwargs):
+        self.done = True
+        if kwargs.get('embed'):
+            stats.check_embed(kwargs['embed'])
+
+    async def send_modal(self, modal):
+        self.done = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        if kwargs.get('embed'):
+            stats.check_embed(kwargs['embed'])
+        message = FakeMessage(self.interaction.guild, self.interaction.guild.text_channel)
+        message.view = kwargs.get('view')
+        self.interaction.sent.append(message)
+        return message
+
+
+class FakeInteraction:
+    def __init__(self, guild, user, message):
+        self.guild = guild
+        self.guild_id = guild.id
+        self.user = user
+        self.message = message
+        self.channel = guild.text_channel
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.sent = []
+
+    async def edit_original_message(self, **kwargs):
+        if kwargs.get('embed'):
+            stats.check_embed(kwargs['embed'])
+
+    async def delete_original_message(self):
+        pass
+
+
+# 시나리오
+async def search_and_pick(main, guild, user, query):
+    """검색창 입력 -> 검색 결과(임시 메시지)에서 첫 번째 곡 선택"""
+    search = main.search_sessions.begin(guild.id, user.id, main.SEARCH_MODAL_TIMEOUT)
+    if not search:
+        stats.rejected_searches += 1
+        return
+    modal = main.SearchModal(guild.player_message, None, search)
+    modal.query = SimpleNamespace(value=query)
+    interaction = FakeInteraction(guild, user, guild.player_message)
+    await modal.callback(interaction)
+
+    views = [m.view for m in interaction.sent if isinstance(m.view, main.SongSelectView)]
+    if not views:
+        return
+    select_view = views[0]
+    pick = FakeInteraction(guild, user, interaction.sent[-1])
+    if await select_view.interaction_check(pick):
+        await select_view.children[0].callback(pick)
+
+
+async def play_link(main, guild, user, video_id):
+    """유튜브 링크를 검색창에 바로 입력"""
+    search = main.search_sessions.begin(guild.id, user.id, main.SEARCH_MODAL_TIMEOUT)
+    if not search:
+        stats.rejected_searches += 1
+        return
+    modal = main.SearchModal(guild.player_message, None, search)
+    modal.query = SimpleNamespace(value=f"https://www.youtube.com/watch?v={video_id}")
+    await modal.callback(FakeInteraction(guild, user, guild.player_message))
+
+
+async def run_user(main, guild, user, args, rng):
+    for i in range(args.requests):
+        await asyncio.sleep(rng.uniform(0, args.think))
+        started = time.perf_counter()
+        if rng.random() < args.link_ratio:
+            await play_link(main, guild, user, f"{user.id % 10 ** 6:06d}{i:05d}")
+        else:
+            await search_and_pick(main, guild, user, f"song {user.id} {i}")
+        stats.requests += 1
+        stats.request_seconds.append(time.perf_counter() - started)
+
+
+async def wait_for_drain(main, guilds, timeout):
+    """모든 서버의 재생목록이 끝날 때까지 대기"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        busy = [
+            g for g in guilds
+            if (g.voice_client and g.voice_client.is_playing()) or main.db.get_queue_length(g.id)
+        ]
+        if not busy:
+            return True
+        await asyncio.sleep(0.1)
+    return False
+
+
+async def simulate(main, args):
+    loop = asyncio.get_running_loop()
+    main.bot.loop = loop
+    main.loop_monitor.start(loop)
+    rng = random.Random(args.seed)
+
+    guilds = [FakeGuild(1000 + i) for i in range(args.guilds)]
+    users = []
+    for guild in guilds:
+        for j in range(args.users):
+            user = FakeUser(guild.id * 100 + j, guild)
+            guild.voice_channel.members.append(user)
+            users.append((guild, user))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(main, g, u, args, random.Random(rng.random())) for g, u in users))
+    requests_done = time.perf_counter() - started
+    drained = await wait_for_drain(main, guilds, args.drain_timeout)
+    return requests_done, time.perf_counter() - started, drained
+
+
+def histogram_summary(histogram, **labels) -> str:
+    """main.py Histogram 버킷으로 평균/대략적인 p50, p95 계산"""
+    state = histogram.values.get(histogram._key(labels))
+    if not state or not state[-1]:
+        return 'n/a'
+    count = state[-1]
+
+    def quantile(q):
+        seen = 0
+        for bound, n in zip(histogram.buckets, state):
+            seen += n
+            if seen >= q * count:
+                return f"<={bound * 1000:.0f}ms"
+        return f">{histogram.buckets[-1] * 1000:.0f}ms"
+
+    return f"n={count} mean={state[-2] / count * 1000:.1f}ms p50{quantile(0.5)} p95{quantile(0.95)}"
+
+
+def load_main(db_path: str):
+    """벤치마크용 환경 변수를 설정하고 main.py 불러오기 (bot.run은 실행되지 않음)"""
+    os.environ['MUSIC_DB_PATH'] = db_path
+    os.environ.setdefault('METRICS_PORT', '0')
+    os.environ.setdefault('LOUDNESS_NORMALIZATION', '0')
+    # AsyncOpenAI는 키가 없으면 만들 때 바로 에러 (채팅은 쓰지 않으므로 가짜 키로 충분)
+    os.environ.setdefault('OPENAI_API_KEY', 'bench')
+    os.environ.pop('AUDIO_CACHE_DIR', None)
+    os.environ.pop('CLUSTER_SOCKET', None)
+    sys.path.insert(0, ROOT)
+    import main
+    main.ytdl = FakeYoutubeDL()
+    main.YoutubeSearch = FakeYoutubeSearch
+    main.create_audio_source = fake_create_audio_source
+    return main
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for main.py")
+    parser.add_argument('--guilds', type=int, default=20, help="서버 수")
+    parser.add_argument('--users', type=int, default=3, help="서버당 유저 수")
+    parser.add_argument('--requests', type=int, default=5, help="유저당 요청 수")
+    parser.add_argument('--link-ratio', type=float, default=0.5, help="링크 요청 비율 (나머지는 검색)")
+    parser.add_argument('--think', type=float, default=0.5, help="요청 사이 최대 대기 시간 (초)")
+    parser.add_argument('--extract-latency', type=float, default=0.2, help="가짜 yt-dlp 지연 (초)")
+    parser.add_argument('--search-latency', type=float, default=0.1, help="가짜 YoutubeSearch 지연 (초)")
+    parser.add_argument('--track-seconds', type=float, default=1.0, help="가짜 곡 길이 (초)")
+    parser.add_argument('--drain-timeout', type=float, default=60, help="재생목록이 다 끝날 때까지 기다리는 최대 시간")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--verbose', action='store_true', help="main.py 로그 출력")
+    args = parser.parse_args()
+
+    FakeYoutubeDL.latency = args.extract_latency
+    FakeYoutubeDL.track_seconds = args.track_seconds
+    FakeYoutubeSearch.latency = args.search_latency
+
+    with tempfile.TemporaryDirectory() as directory:
+        bot_main = load_main(os.path.join(directory, 'bench.db'))
+        tracemalloc.start()
+        log = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with log:
+            requests_done, total, drained = asyncio.run(simulate(bot_main, args))
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    lag = bot_main.loop_monitor.snapshot()
+    request_seconds = sorted(stats.request_seconds) or [0.0]
+    print(f"guilds: {args.guilds}, users/guild: {args.users}, requests/user: {args.requests}")
+    print(f"requests:        {stats.requests} in {requests_done:.2f}s "
+          f"({stats.requests / requests_done:.1f} req/s), rejected searches: {stats.rejected_searches}")
+    print(f"request latency: p50 {request_seconds[len(request_seconds) // 2] * 1000:.0f}ms "
+          f"p95 {request_seconds[int(len(request_seconds) * 0.95)] * 1000:.0f}ms")
+    print(f"tracks started:  {stats.tracks_started}, queues drained: {drained} ({total:.2f}s total)")
+    print(f"TTFA:            {histogram_summary(bot_main.TIME_TO_FIRST_AUDIO)}")
+    print(f"play-next gap:   {histogram_summary(bot_main.PLAY_NEXT_GAP)}")
+    print(f"extract_info:    {histogram_summary(bot_main.EXTRACT_INFO_SECONDS, kind='song_info')}")
+    print(f"loop lag:        p50 {lag['p50_ms']}ms p99 {lag['p99_ms']}ms max {lag['max_ms']}ms, "
+          f"slow callbacks: {lag['slow_callbacks']}")
+    print(f"memory:          current {current / 2 ** 20:.1f}MiB, peak {peak / 2 ** 20:.1f}MiB")
+    print(f"player edits:    {stats.player_edits} ({stats.player_edits / max(stats.requests, 1):.2f}/request)")
+    print(f"errors:          {len(stats.errors)}")
+    for error in sorted(set(stats.errors))[:5]:
+        print(f"  - {error}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""스트림당 FFmpeg CPU 사용량 벤치마크 (passthrough vs transcode)
+
+main.py의 create_audio_source로 봇과 똑같은 FFmpeg 소스를 여러 개 동시에 만들고
+패킷을 끝까지 읽어서 재생 1초당 CPU 시간을 잰다. FFmpeg 인자는 nextcord.FFmpegOpusAudio가
+직접 만들기 때문에 봇이 실제로 돌리는 명령과 같다. 입력 파일이 없으면 테스트용 Opus/WebM 파일을 만든다.
+(봇 의존성(nextcord 등)이 설치되어 있어야 함)
+
+    python benchmarks/opus_cpu.py --streams 8
+    python benchmarks/opus_cpu.py --input song.webm --streams 32
+"""
+import argparse
+import asyncio
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 이름: (PLAYBACK_MODE, 측정된 트랙 라우드니스 LUFS 또는 None)
+# 게인은 봇과 같은 get_playback_gain_db로 계산함
+MODES = {
+    'passthrough': ('passthrough', None),
+    'passthrough-loud': ('passthrough', -9.0),  # 크게 마스터링된 곡 (평준화로 줄여야 함)
+    'passthrough-quiet': ('passthrough', -17.0),  # 조용한 곡 (키워야 해서 다시 인코딩)
+    'transcode': ('transcode', None),
+    'transcode+gain': ('transcode', -17.0),
+}
+
+
+def load_bot(directory: str):
+    """main.py 불러오기 (임시 DB 사용, bot.run은 실행되지 않음)"""
+    os.environ['MUSIC_DB_PATH'] = os.path.join(directory, 'bench.db')
+    os.environ.setdefault('METRICS_PORT', '0')
+    os.environ.setdefault('OPENAI_API_KEY', 'bench')
+    os.environ.pop('AUDIO_CACHE_DIR', None)
+    os.environ.pop('CLUSTER_SOCKET', None)
+    sys.path.insert(0, ROOT)
+    import main
+    return main
+
+
+def make_test_input(directory: str, seconds: int) -> str:
+    path = os.path.join(directory, 'bench.webm')
+    subprocess.run([
+        'ffmpeg', '-nostdin', '-loglevel', 'error', '-y',
+        '-f', 'lavfi', '-i', f'anoisesrc=d={seconds}:c=pink:a=0.3',
+        '-f', 'lavfi', '-i', f'sine=f=440:d={seconds}',
+        '-filter_complex', 'amix=inputs=2,aformat=channel_layouts=stereo',
+        '-c:a', 'libopus', '-b:a', '128k', path
+    ], check=True)
+    return path
+
+
+def probe_duration(path: str) -> float:
+    output = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.strip())
+
+
+def drain(source) -> int:
+    """음성 클라이언트처럼 패킷을 끝까지 읽기 (읽은 패킷 수 반환)"""
+    packets = 0
+    try:
+        while source.read():
+            packets += 1
+    finally:
+        source.cleanup()
+    return packets
+
+
+def run_mode(bot, path: str, playback_mode: str, lufs, streams: int) -> dict:
+    bot.PLAYBACK_MODE = playback_mode
+    track_id = None
+    if lufs is not None:
+        track_id = 'bench'
+        bot.loudness_analyzer.cache[track_id] = lufs
+    gain_db = bot.get_playback_gain_db(track_id, 0, 'opus')
+
+    async def create_sources():
+        # 로컬 캐시 파일을 재생할 때와 같은 인자
+        return await asyncio.gather(*(
+            bot.create_audio_source(path, 'opus', gain_db, before_options='')
+            for _ in range(streams)
+        ))
+
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    started = time.perf_counter()
+    sources = asyncio.run(create_sources())
+    with ThreadPoolExecutor(max_workers=streams) as pool:
+        packets = list(pool.map(drain, sources))
+    wall = time.perf_counter() - started
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return {'cpu': cpu, 'wall': wall, 'gain': gain_db, 'failed': sum(1 for n in packets if n == 0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FFmpeg CPU per voice stream")
+    parser.add_argument('--input', help="Opus/WebM 입력 파일 (없으면 생성)")
+    parser.add_argument('--seconds', type=int, default=120, help="생성할 테스트 파일 길이")
+    parser.add_argument('--streams', type=int, default=4, help="동시에 돌릴 스트림 수")
+    parser.add_argument('--modes', default=','.join(MODES), help="쉼표로 구분한 모드 목록")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        bot = load_bot(directory)
+        path = args.input or make_test_input(directory, args.seconds)
+        duration = probe_duration(path)
+        print(f"input: {path} ({duration:.1f}s), streams: {args.streams}")
+        print(f"{'mode':<20}{'gain dB':>9}{'cpu s':>10}{'wall s':>10}{'cpu/stream-s':>15}{'streams/core':>15}")
+
+        for mode in args.modes.split(','):
+            playback_mode, lufs = MODES[mode]
+            result = run_mode(bot, path, playback_mode, lufs, args.streams)
+            # 실시간 재생 1초당 CPU 초 -> 코어 하나로 감당 가능한 동시 스트림 수
+            per_stream_second = result['cpu'] / (duration * args.streams)
+            capacity = 1 / per_stream_second if per_stream_second else float('inf')
+            failed = f"  ({result['failed']} failed)" if result['failed'] else ''
+            print(f"{mode:<20}{result['gain']:>9.1f}{result['cpu']:>10.2f}{result['wall']:>10.2f}"
+                  f"{per_stream_second:>15.5f}{capacity:>15.0f}{failed}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,410 @@
+"""미루 클러스터 런처
+
+워커 프로세스 N개를 띄우고 각 워커에 샤드 범위를 나눠준다.
+슈퍼바이저와 워커는 유닉스 소켓 위에서 줄 단위 JSON으로 통신한다.
+
+    python cluster.py --workers 4 --shards 16   # 클러스터 실행
+    python cluster.py status                     # 워커 상태 확인
+    python cluster.py restart                    # 롤링 재시작
+
+워커 쪽은 main.py가 CLUSTER_SOCKET 환경변수를 보고 ClusterClient로 접속한다.
+각 워커의 /metrics는 METRICS_PORT + CLUSTER_ID 포트에서 열린다.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import signal
+import sys
+import time
+
+import cachetools
+
+DEFAULT_SOCKET = os.getenv("CLUSTER_SOCKET", "/tmp/miru-cluster.sock")
+HEARTBEAT_INTERVAL = 10     # 워커 -> 슈퍼바이저 하트비트 주기 (초)
+HEARTBEAT_TIMEOUT = 45      # 이 시간 동안 하트비트가 없으면 워커 재시작
+READY_TIMEOUT = 180         # 재시작한 워커가 준비될 때까지 기다리는 시간
+SHUTDOWN_TIMEOUT = 30       # 종료 요청 후 강제 종료까지 기다리는 시간
+REQUEST_TIMEOUT = 2.0       # 워커의 IPC 요청 타임아웃
+STREAM_LIMIT = 4 * 1024 * 1024      # 소켓에서 읽는 한 줄(메시지)의 최대 크기
+CACHE_VALUE_MAX_BYTES = 256 * 1024  # 이보다 큰 값은 공유 캐시에 올리지 않음
+
+# 슈퍼바이저가 들고 있는 공유 캐시 (네임스페이스별)
+SHARED_CACHES = {
+    'track': {'maxsize': 20000, 'ttl': 3600},        # 곡 메타데이터
+    'saved_queue': {'maxsize': 5000, 'ttl': 86400},  # 저장된 재생목록
+}
+
+
+def encode(payload: dict) -> bytes:
+    return json.dumps(payload, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+def shard_ranges(shard_count: int, worker_count: int) -> list:
+    """샤드를 워커 수만큼 연속된 구간으로 나눈다"""
+    per_worker, extra = divmod(shard_count, worker_count)
+    ranges = []
+    start = 0
+    for i in range(worker_count):
+        size = per_worker + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+class Worker:
+    """슈퍼바이저가 관리하는 워커 프로세스 하나의 상태"""
+    def __init__(self, cluster_id: int, shard_ids: list):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.process = None
+        self.writer = None
+        self.ready = asyncio.Event()
+        self.last_heartbeat = 0.0
+        self.started_at = 0.0
+        self.restarts = 0
+        self.stats = {}
+        self.restarting = False
+
+    def status(self) -> dict:
+        return {
+            'cluster_id': self.cluster_id,
+            'shard_ids': self.shard_ids,
+            'pid': self.process.pid if self.process else None,
+            'alive': bool(self.process and self.process.returncode is None),
+            'ready': self.ready.is_set(),
+            'restarts': self.restarts,
+            'uptime': round(time.monotonic() - self.started_at, 1) if self.started_at else 0,
+            'last_heartbeat': round(time.monotonic() - self.last_heartbeat, 1) if self.last_heartbeat else None,
+            **self.stats
+        }
+
+
+class Supervisor:
+    def __init__(self, worker_count: int, shard_count: int, socket_path: str, command: list):
+        self.socket_path = socket_path
+        self.command = command
+        self.shard_count = shard_count
+        self.workers = [
+            Worker(i, shards)
+            for i, shards in enumerate(shard_ranges(shard_count, worker_count))
+        ]
+        self.caches = {
+            name: cachetools.TTLCache(maxsize=opts['maxsize'], ttl=opts['ttl'])
+            for name, opts in SHARED_CACHES.items()
+        }
+        self.server = None
+        self.stopping = asyncio.Event()
+        self.restart_lock = asyncio.Lock()
+
+    async def run(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.server = await asyncio.start_unix_server(
+            self.handle_connection, path=self.socket_path, limit=STREAM_LIMIT
+        )
+        os.chmod(self.socket_path, 0o600)
+
+        loop = asyncio.get_running_loop()
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self.rolling_restart()))
+        loop.add_signal_handler(signal.SIGINT, self.stopping.set)
+        loop.add_signal_handler(signal.SIGTERM, self.stopping.set)
+
+        print(f"Cluster supervisor listening on {self.socket_path} "
+              f"({len(self.workers)} workers, {self.shard_count} shards)")
+
+        # 처음 띄울 때도 한 번에 하나씩 (디스코드 identify 제한)
+        for worker in self.workers:
+            await self.spawn(worker)
+            await self.wait_ready(worker)
+
+        health_task = asyncio.ensure_future(self.health_check())
+        await self.stopping.wait()
+        health_task.cancel()
+        await self.stop()
+
+    async def spawn(self, worker: Worker):
+        env = os.environ.copy()
+        env.update({
+            'CLUSTER_ID': str(worker.cluster_id),
+            'CLUSTER_SOCKET': self.socket_path,
+            'SHARD_IDS': ','.join(map(str, worker.shard_ids)),
+            'SHARD_COUNT': str(self.shard_count),
+        })
+        worker.ready.clear()
+        worker.writer = None
+        worker.stats = {}
+        worker.process = await asyncio.create_subprocess_exec(*self.command, env=env)
+        worker.started_at = time.monotonic()
+        worker.last_heartbeat = time.monotonic()
+        print(f"Worker {worker.cluster_id} started (pid {worker.process.pid}, shards {worker.shard_ids})")
+
+    async def wait_ready(self, worker: Worker) -> bool:
+        try:
+            await asyncio.wait_for(worker.ready.wait(), timeout=READY_TIMEOUT)
+            return True
+        except asyncio.TimeoutError:
+            print(f"Worker {worker.cluster_id} did not become ready in {READY_TIMEOUT}s")
+            return False
+
+    async def terminate(self, worker: Worker):
+        process = worker.process
+        if not process or process.returncode is not None:
+            return
+        try:
+            if worker.writer:
+                worker.writer.write(encode({'op': 'shutdown'}))
+                await worker.writer.drain()
+            else:
+                process.terminate()
+            await asyncio.wait_for(process.wait(), timeout=SHUTDOWN_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError):
+            process.kill()
+            await process.wait()
+
+    async def restart_worker(self, worker: Worker, reason: str):
+        if worker.restarting:
+            return
+        worker.restarting = True
+        try:
+            print(f"Restarting worker {worker.cluster_id}: {reason}")
+            await self.terminate(worker)
+            worker.restarts += 1
+            await self.spawn(worker)
+            await self.wait_ready(worker)
+        finally:
+            worker.restarting = False
+
+    async def rolling_restart(self):
+        """워커를 하나씩 재시작해서 전체 서비스가 끊기지 않게 한다"""
+        async with self.restart_lock:
+            for worker in self.workers:
+                if self.stopping.is_set():
+                    return
+                await self.restart_worker(worker, "rolling restart")
+
+    async def health_check(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            if self.restart_lock.locked():
+                continue
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.restarting:
+                    continue
+                if worker.process.returncode is not None:
+                    await self.restart_worker(worker, f"exited with code {worker.process.returncode}")
+                elif now - worker.last_heartbeat > HEARTBEAT_TIMEOUT:
+                    await self.restart_worker(worker, "heartbeat timeout")
+
+    async def stop(self):
+        print("Stopping cluster...")
+        await asyncio.gather(*(self.terminate(w) for w in self.workers), return_exceptions=True)
+        self.server.close()
+        await self.server.wait_closed()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    async def handle_connection(self, reader, writer):
+        worker = None
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError as e:
+                    # 한도를 넘은 메시지 하나만 버리고 연결은 유지
+                    print(f"Dropped oversized cluster message: {e}")
+                    continue
+                if not line:
+                    break
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    continue
+
+                op = msg.get('op')
+                if op == 'hello':
+                    cluster_id = msg.get('cluster_id')
+                    if cluster_id is not None and 0 <= cluster_id < len(self.workers):
+                        worker = self.workers[cluster_id]
+                        worker.writer = writer
+                        worker.last_heartbeat = time.monotonic()
+                    continue
+
+                reply = self.handle_request(worker, op, msg)
+                if reply is not None and 'nonce' in msg:
+                    reply['nonce'] = msg['nonce']
+                    writer.write(encode(reply))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            if worker and worker.writer is writer:
+                worker.writer = None
+            writer.close()
+
+    def handle_request(self, worker, op, msg):
+        if op == 'heartbeat':
+            if worker:
+                worker.last_heartbeat = time.monotonic()
+                worker.stats = msg.get('stats', {})
+            return None
+        if op == 'ready':
+            if worker:
+                worker.ready.set()
+            return None
+        if op in ('cache_get', 'cache_set', 'cache_delete'):
+            cache = self.caches.get(msg.get('namespace'))
+            if cache is None:
+                return {'ok': False, 'error': 'unknown namespace'}
+            key = msg.get('key')
+            if op == 'cache_get':
+                return {'ok': True, 'value': cache.get(key)}
+            if op == 'cache_set':
+                cache[key] = msg.get('value')
+            else:
+                cache.pop(key, None)
+            return {'ok': True}
+        if op == 'status':
+            return {
+                'ok': True,
+                'workers': [w.status() for w in self.workers],
+                'caches': {name: len(cache) for name, cache in self.caches.items()}
+            }
+        if op == 'rolling_restart':
+            asyncio.ensure_future(self.rolling_restart())
+            return {'ok': True}
+        return {'ok': False, 'error': f'unknown op {op}'}
+
+
+class ClusterClient:
+    """워커 쪽에서 슈퍼바이저와 통신하는 클라이언트"""
+    def __init__(self, socket_path: str, cluster_id: int = None):
+        self.socket_path = socket_path
+        self.cluster_id = cluster_id
+        self.reader = None
+        self.writer = None
+        self.pending = {}
+        self.nonces = itertools.count()
+        self.on_shutdown = None
+        self._read_task = None
+
+    @property
+    def connected(self) -> bool:
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def connect(self, on_shutdown=None):
+        self.on_shutdown = on_shutdown
+        self.reader, self.writer = await asyncio.open_unix_connection(self.socket_path, limit=STREAM_LIMIT)
+        if self.cluster_id is not None:
+            await self.send({'op': 'hello', 'cluster_id': self.cluster_id})
+        self._read_task = asyncio.ensure_future(self._read_loop())
+
+    async def send(self, payload: dict):
+        self.writer.write(encode(payload))
+        await self.writer.drain()
+
+    async def _read_loop(self):
+        try:
+            while True:
+                try:
+                    line = await self.reader.readline()
+                    if not line:
+                        break
+                    msg = json.loads(line)
+                except ValueError as e:
+                    # 깨지거나 너무 긴 메시지 하나 때문에 워커를 내리지 않음 (기다리던 요청은 타임아웃)
+                    print(f"Dropped bad cluster message: {e}")
+                    continue
+                future = self.pending.pop(msg.get('nonce'), None)
+                if future and not future.done():
+                    future.set_result(msg)
+                elif msg.get('op') == 'shutdown':
+                    break
+        except ConnectionError as e:
+            print(f"Cluster connection error: {e}")
+        finally:
+            self.writer.close()
+            for future in self.pending.values():
+                if not future.done():
+                    future.cancel()
+            self.pending.clear()
+            # 슈퍼바이저가 사라졌거나 종료를 요청하면 워커도 내려간다
+            if self.on_shutdown:
+                await self.on_shutdown()
+
+    async def request(self, op: str, **kwargs):
+        if not self.connected:
+            return None
+        nonce = next(self.nonces)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[nonce] = future
+        try:
+            await self.send({'op': op, 'nonce': nonce, **kwargs})
+            return await asyncio.wait_for(future, timeout=REQUEST_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.CancelledError, ConnectionError):
+            return None
+        finally:
+            self.pending.pop(nonce, None)
+
+    async def cache_get(self, namespace: str, key: str):
+        reply = await self.request('cache_get', namespace=namespace, key=key)
+        return reply.get('value') if reply else None
+
+    async def cache_set(self, namespace: str, key: str, value):
+        # 큰 값(곡이 많은 재생목록 등)은 각 워커가 DB에서 읽는 편이 낫다
+        if len(encode({'value': value})) > CACHE_VALUE_MAX_BYTES:
+            return
+        await self.request('cache_set', namespace=namespace, key=key, value=value)
+
+    async def notify_ready(self):
+        if self.connected:
+            await self.send({'op': 'ready'})
+
+    async def heartbeat_loop(self, stats_fn):
+        while self.connected:
+            try:
+                await self.send({'op': 'heartbeat', 'stats': stats_fn()})
+            except ConnectionError:
+                return
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+async def control(socket_path: str, op: str):
+    client = ClusterClient(socket_path)
+    await client.connect()
+    reply = await client.request(op)
+    print(json.dumps(reply, ensure_ascii=False, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="미루 클러스터 런처")
+    parser.add_argument('action', nargs='?', default='run', choices=['run', 'status', 'restart'])
+    parser.add_argument('--workers', type=int, default=int(os.getenv('CLUSTER_WORKERS', '2')))
+    parser.add_argument('--shards', type=int, default=None, help="전체 샤드 수 (기본값: 워커 수)")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET)
+    parser.add_argument('--command', default=None, help="워커 실행 명령 (기본값: python main.py)")
+    args = parser.parse_args()
+
+    if args.action == 'status':
+        asyncio.run(control(args.socket, 'status'))
+        return
+    if args.action == 'restart':
+        asyncio.run(control(args.socket, 'rolling_restart'))
+        return
+
+    shard_count = args.shards or args.workers
+    if shard_count < args.workers:
+        parser.error("샤드 수는 워커 수보다 적을 수 없어!")
+
+    if args.command:
+        command = args.command.split()
+    else:
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')]
+
+    asyncio.run(Supervisor(args.workers, shard_count, args.socket, command).run())
+
+
+if __name__ == '__main__':
+    main()
@@ -13,91 +13,241 @@ import string
 import re
 from datetime import datetime
 import cachetools  # 새로 추가
-from openai import OpenAI   # gpt
+from openai import AsyncOpenAI   # gpt
 import traceback
+import time
+import sys
+import io
+import json
+import threading
+import collections
+import functools
+import unicodedata
+import math
+import hashlib
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from cluster import ClusterClient
 
 # 캐시 설정 개선
 CACHE_TTL = 3600  # 1시간
 CACHE_MAX_SIZE = 1000  # 서버당 최대 캐시 크기
-guild_caches = {}  # 서버별 캐시 저장소
+
+# 서버 세션 정리 설정
+SESSION_IDLE_TTL = 3600  # 음성 연결 없이 1시간 동안 안 쓰인 세션은 정리
+SESSION_CLEANUP_INTERVAL = 600  # 10분마다 체크
 
 class GuildCache:
     def __init__(self):
         self.song_cache = cachetools.TTLCache(maxsize=100, ttl=CACHE_TTL)
         self.url_cache = cachetools.TTLCache(maxsize=100, ttl=CACHE_TTL)
-        self.last_accessed = datetime.now()
-
-def get_guild_cache(guild_id: int) -> GuildCache:
-    if guild_id not in guild_caches:
-        guild_caches[guild_id] = GuildCache()
-    guild_caches[guild_id].last_accessed = datetime.now()
-    return guild_caches[guild_id]
-
-# 캐시 클린업 작업
-async def cleanup_guild_caches():
-    while True:
-        try:
-            current_time = datetime.now()
-            inactive_guilds = []
-            
-            for guild_id, cache in guild_caches.items():
-                # 24시간 이상 미사용된 캐시 제거
-                if (current_time - cache.last_accessed).total_seconds() > 86400:
-                    inactive_guilds.append(guild_id)
-            
-            for guild_id in inactive_guilds:
-                del guild_caches[guild_id]
-                
-            await asyncio.sleep(3600)  # 1시간마다 체크
-        except Exception as e:
-            print(f"Cache cleanup error: {e}")
-            await asyncio.sleep(3600)
 
 load_dotenv()
 
 intents = nextcord.Intents.default()
-intents.message_content = True
+# 음악만 쓰는 경우 MESSAGE_CONTENT_INTENT=0으로 특권 인텐트 없이 실행 가능 (미루야 채팅 비활성화)
+MESSAGE_CONTENT_INTENT = os.getenv("MESSAGE_CONTENT_INTENT", "1") != "0"
+CHAT_PREFIX = "미루야"
+CHAT_OPT_IN = os.getenv("CHAT_OPT_IN", "0") == "1"  # 1이면 서버에서 /채팅으로 켜야만 채팅 사용
+intents.message_content = MESSAGE_CONTENT_INTENT
 intents.voice_states = True
-bot = commands.Bot(command_prefix='미루야', intents=intents)
-openai = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))    # gpt
 
-# 전역 변수들
-current_playing = {}  # 현재 재생 중인 노래 정보
-search_locks = {}     # 검색 락
-voice_states = {}     # 음성 상태
-repeat_states = {}    # 반복 재생 상태
-shuffle_states = {}   # 셔플 상태
+# 클러스터 모드 (cluster.py가 워커로 실행하면 환경변수로 샤드 범위를 넘겨줌)
+CLUSTER_ID = os.getenv("CLUSTER_ID")
+CLUSTER_SOCKET = os.getenv("CLUSTER_SOCKET")
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv("SHARD_IDS", "").split(",") if shard_id]
+
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(
+        command_prefix=CHAT_PREFIX,
+        intents=intents,
+        shard_count=SHARD_COUNT,
+        shard_ids=SHARD_IDS or None
+    )
+else:
+    bot = commands.Bot(command_prefix=CHAT_PREFIX, intents=intents)
 
-class SearchLock:
+cluster = ClusterClient(CLUSTER_SOCKET, int(CLUSTER_ID or 0)) if CLUSTER_SOCKET else None
+
+def owns_guild(guild_id: int) -> bool:
+    """이 프로세스가 맡은 샤드의 서버인지 확인"""
+    if not SHARD_COUNT or not SHARD_IDS:
+        return True
+    return (guild_id >> 22) % SHARD_COUNT in SHARD_IDS
+
+# GPT 설정
+GPT_MODEL = os.getenv("GPT_MODEL", "gpt-4.1-mini")
+GPT_MAX_CONCURRENCY = int(os.getenv("GPT_MAX_CONCURRENCY", "4"))  # 동시에 처리하는 GPT 요청 수
+GPT_QUEUE_TIMEOUT = 15  # 빈 자리를 기다리는 최대 시간 (초)
+GPT_TIMEOUT = float(os.getenv("GPT_TIMEOUT", "60"))  # 답변 하나에 걸리는 최대 시간 (초)
+GPT_USER_RATE_LIMIT = 5  # 유저당 요청 수
+GPT_USER_RATE_WINDOW = 60  # 위 요청 수를 세는 구간 (초)
+GPT_EDIT_INTERVAL = 1.0  # 스트리밍 중 메시지 수정 간격 (초)
+GPT_CACHE_SIZE = 500  # 자주 묻는 질문 답변 캐시 크기
+GPT_CACHE_TTL = 3600  # 답변 캐시 유지 시간 (초)
+GPT_HISTORY_CHANNELS = 2000  # 대화 맥락을 기억하는 채널 수
+GPT_HISTORY_TTL = 1800  # 이 시간 동안 대화가 없으면 맥락 초기화 (초)
+GPT_HISTORY_TOKEN_BUDGET = 1500  # 대화 맥락에 쓰는 최대 토큰 (대략)
+GPT_SUMMARY_MAX_TOKENS = 300  # 오래된 대화 요약 길이
+GPT_SYSTEM_PROMPT = "당신의 이름은 '미루'이고 나이는 '18'살 '여고생'입니다. 답변을 반말로 하고 답변에 애교를 최대한 많이 섞어주세요. 만약 당신을 누가 만들었는지 물어본다면 hyexn이라는 분이 만들었다고 대답해주세요. 만약 어떤 모델을 사용하는지 물어본다면 OpenAI의의 GPT-4.1 mini를 사용하고 있다고 대답해주세요. 언제 태어났냐고 물어본다면 2008년 05월 10일 이라고 대답하세요."
+
+# OPENAI_BASE_URL을 지정하면 로컬 스텁 서버로 테스트할 수 있음
+openai = AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    base_url=os.getenv("OPENAI_BASE_URL") or None,
+    timeout=GPT_TIMEOUT,
+    max_retries=1
+)    # gpt
+
+# 서버별 상태 (GuildSession)
+guild_sessions = {}
+
+# 검색 세션 설정
+SEARCH_MODAL_TIMEOUT = 300  # 검색창을 띄워두고 기다리는 최대 시간 (초)
+SEARCH_MAX_SESSIONS_PER_GUILD = 5  # 한 서버에서 동시에 검색할 수 있는 인원
+
+class SearchSession:
+    __slots__ = ('guild_id', 'user_id', 'token', 'expires_at')
+
+    def __init__(self, guild_id: int, user_id: int, token: int, expires_at: float):
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.token = token
+        self.expires_at = expires_at
+
+class SearchSessionManager:
+    """서버별 유저 검색 세션 (유저마다 하나, 시간이 지나면 자동으로 만료)
+
+    세션마다 토큰이 있어서, 같은 유저가 검색을 다시 시작하면 예전 검색창/결과는 무시됨
+    """
     def __init__(self):
-        self.is_locked = False
-        self.current_user = None
+        self.sessions = {}  # guild_id -> {user_id: SearchSession}
+        self.next_token = 0
+
+    def active_sessions(self, guild_id: int) -> dict:
+        sessions = self.sessions.get(guild_id, {})
+        now = time.monotonic()
+        for user_id in [u for u, session in sessions.items() if session.expires_at <= now]:
+            del sessions[user_id]
+        if not sessions:
+            self.sessions.pop(guild_id, None)
+        return sessions
+
+    def begin(self, guild_id: int, user_id: int, ttl: float):
+        """새 검색 세션 시작, 서버에 검색 중인 사람이 너무 많으면 None"""
+        sessions = self.active_sessions(guild_id)
+        if user_id not in sessions and len(sessions) >= SEARCH_MAX_SESSIONS_PER_GUILD:
+            return None
+        self.next_token += 1
+        session = SearchSession(guild_id, user_id, self.next_token, time.monotonic() + ttl)
+        self.sessions.setdefault(guild_id, {})[user_id] = session
+        return session
+
+    def is_active(self, session: SearchSession) -> bool:
+        current = self.active_sessions(session.guild_id).get(session.user_id)
+        return current is not None and current.token == session.token
+
+    def extend(self, session: SearchSession, ttl: float) -> bool:
+        """검색 결과 선택처럼 다음 단계로 넘어갈 때 만료 시각 연장"""
+        if not self.is_active(session):
+            return False
+        session.expires_at = time.monotonic() + ttl
+        return True
+
+    def end(self, session: SearchSession):
+        sessions = self.sessions.get(session.guild_id)
+        if sessions and sessions.get(session.user_id) is session:
+            del sessions[session.user_id]
+            if not sessions:
+                del self.sessions[session.guild_id]
+
+search_sessions = SearchSessionManager()
+
+class IdleScheduler:
+    """모든 서버의 자동 퇴장 시각을 힙 하나로 관리 (서버마다 타이머 태스크를 만들지 않음)
+
+    예약/재예약은 힙에 넣기만 하고(O(log n)), 이전 항목은 꺼낼 때 버린다.
+    이벤트 루프에는 가장 이른 시각의 call_at 핸들 하나만 걸어둔다.
+    """
+    def __init__(self):
+        self.heap = []  # (deadline, seq, guild_id)
+        self.entries = {}  # guild_id -> (seq, voice_state, voice_client, message)
+        self.seq = 0
+        self.handle = None
+        self.handle_deadline = None
+
+    def schedule(self, guild_id: int, delay: float, voice_state, voice_client, message):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + delay
+        self.seq += 1
+        self.entries[guild_id] = (self.seq, voice_state, voice_client, message)
+        heapq.heappush(self.heap, (deadline, self.seq, guild_id))
+        # 취소된 항목이 너무 많이 쌓이면 힙을 다시 만듦
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [item for item in self.heap if self.is_live(item)]
+            heapq.heapify(self.heap)
+        self.arm(loop)
+
+    def cancel(self, guild_id: int):
+        self.entries.pop(guild_id, None)
+
+    def is_live(self, item) -> bool:
+        entry = self.entries.get(item[2])
+        return entry is not None and entry[0] == item[1]
+
+    def arm(self, loop):
+        while self.heap and not self.is_live(self.heap[0]):
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return
+        deadline = self.heap[0][0]
+        if self.handle and self.handle_deadline <= deadline:
+            return
+        if self.handle:
+            self.handle.cancel()
+        self.handle = loop.call_at(deadline, self.fire)
+        self.handle_deadline = deadline
+
+    def fire(self):
+        loop = asyncio.get_running_loop()
+        self.handle = None
+        now = loop.time()
+        while self.heap and self.heap[0][0] <= now:
+            item = heapq.heappop(self.heap)
+            if not self.is_live(item):
+                continue
+            _, voice_state, voice_client, message = self.entries.pop(item[2])
+            if voice_client and voice_client.is_connected():
+                channel_members = len([m for m in voice_client.channel.members if not m.bot])
+                if channel_members == 0:
+                    # 실제로 나갈 때만 태스크 생성
+                    loop.create_task(voice_state.handle_disconnect(voice_client, message))
+        self.arm(loop)
+
+idle_scheduler = IdleScheduler()
 
 class VoiceState:
     def __init__(self):
-        self.timer_task = None
+        self.guild_id = None
         self.leave_timer = 300  # 5분 타이머
 
     async def start_timer(self, voice_client, message):
-        if self.timer_task:
-            self.timer_task.cancel()
-        
-        self.timer_task = asyncio.create_task(self.timer_callback(voice_client, message))
+        self.guild_id = message.guild.id
+        idle_scheduler.schedule(self.guild_id, self.leave_timer, self, voice_client, message)
 
-    async def timer_callback(self, voice_client, message):
-        await asyncio.sleep(self.leave_timer)
-        if voice_client and voice_client.is_connected():
-            channel_members = len([m for m in voice_client.channel.members if not m.bot])
-            if channel_members == 0:
-                await self.handle_disconnect(voice_client, message)
+    def cancel_timer(self):
+        if self.guild_id is not None:
+            idle_scheduler.cancel(self.guild_id)
 
     async def handle_disconnect(self, voice_client, message):
         try:
+            mark_stop_requested(message.guild.id)
             if voice_client and voice_client.is_connected():
                 await voice_client.disconnect()
             
             guild_id = message.guild.id
-            current_playing.pop(guild_id, None)
+            clear_current_playing_song(guild_id)
             db.clear_guild_queue(guild_id)
             
             try:
@@ -132,9 +282,7 @@ class VoiceState:
             
         finally:
             # 타이머 정리
-            if self.timer_task:
-                self.timer_task.cancel()
-                self.timer_task = None
+            self.cancel_timer()
     
 
 class VoiceStateWithRetry(VoiceState):
@@ -152,38 +300,446 @@ class VoiceStateWithRetry(VoiceState):
                 self.retry_count += 1
                 if self.retry_count >= self.max_retries:
                     raise e
-                await asyncio.sleep(1)
+                await asyncio.sleep(2 ** (self.retry_count - 1))  # 1초, 2초, 4초...
+
+class GuildSession:
+    """서버별 상태를 한 곳에 모아둔 객체 (서버당 딕셔너리 조회 한 번)"""
+    __slots__ = (
+        'guild_id', 'current_song', 'repeat', 'shuffle', 'track_origin',
+        'stop_requested', 'recoveries', 'voice_channel_id',
+        'human_count', 'voice_eval_handle', 'player',
+        'voice_state', 'cache', 'play_lock', 'last_active'
+    )
+
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        self.current_song = None
+        self.repeat = False
+        self.shuffle = False
+        self.track_origin = None  # 현재 곡의 0초 지점에 해당하는 monotonic 시각
+        self.stop_requested = False  # 스킵/나가기처럼 유저가 재생을 멈춘 경우
+        self.recoveries = 0  # 현재 곡에서 복구를 시도한 횟수
+        self.voice_channel_id = None  # 연결이 끊겼을 때 다시 들어갈 채널
+        self.human_count = None  # (봇이 있는 채널 ID, 사람 수), 입퇴장 이벤트로 갱신
+        self.voice_eval_handle = None  # 몰려오는 음성 이벤트를 한 번에 처리하는 call_later 핸들
+        self.player = None  # GuildPlayer (곡 전환을 처리하는 서버별 태스크)
+        self.voice_state = VoiceStateWithRetry()
+        self.cache = GuildCache()
+        self.play_lock = asyncio.Lock()
+        self.last_active = time.monotonic()
+
+    def is_idle(self, now: float) -> bool:
+        """오래 안 쓰였고 재생 중인 작업도 없는지"""
+        return (
+            now - self.last_active > SESSION_IDLE_TTL
+            and not self.play_lock.locked()
+        )
+
+    def close(self):
+        self.voice_state.cancel_timer()
+        if self.player:
+            self.player.close()
+            self.player = None
+        if self.voice_eval_handle:
+            self.voice_eval_handle.cancel()
+            self.voice_eval_handle = None
+
+def get_session(guild_id: int) -> GuildSession:
+    session = guild_sessions.get(guild_id)
+    if session is None:
+        session = guild_sessions[guild_id] = GuildSession(guild_id)
+    session.last_active = time.monotonic()
+    return session
+
+def get_guild_cache(guild_id: int) -> GuildCache:
+    return get_session(guild_id).cache
 
-def get_search_lock(guild_id: int) -> SearchLock:
-    if guild_id not in search_locks:
-        search_locks[guild_id] = SearchLock()
-    return search_locks[guild_id]
 
 def get_voice_state(guild_id: int) -> VoiceState:
-    if guild_id not in voice_states:
-        voice_states[guild_id] = VoiceState()
-    return voice_states[guild_id]
+    return get_session(guild_id).voice_state
 
 def get_repeat_state(guild_id: int) -> bool:
-    return repeat_states.get(guild_id, False)
+    session = guild_sessions.get(guild_id)
+    return session.repeat if session else False
 
 def get_shuffle_state(guild_id: int) -> bool:
-    return shuffle_states.get(guild_id, False)
+    session = guild_sessions.get(guild_id)
+    return session.shuffle if session else False
 
 def get_current_playing_song(guild_id: int):
-    return current_playing.get(guild_id)
+    session = guild_sessions.get(guild_id)
+    return session.current_song if session else None
+
+def set_current_playing_song(guild_id: int, song_info: dict, offset: float = 0.0):
+    session = get_session(guild_id)
+    if song_info is not session.current_song:
+        # 같은 곡을 다시 트는 복구/위치 이동 중에 눌린 스킵/나가기 표시는 지우지 않음
+        session.recoveries = 0
+        session.stop_requested = False
+    session.current_song = song_info
+    session.track_origin = time.monotonic() - offset
+
+def mark_stop_requested(guild_id: int):
+    """유저가 직접 멈춘 재생은 복구하지 않도록 표시"""
+    session = guild_sessions.get(guild_id)
+    if session:
+        session.stop_requested = True
+
+def clear_current_playing_song(guild_id: int):
+    session = guild_sessions.get(guild_id)
+    if session:
+        session.current_song = None
+        session.track_origin = None
+
+def get_playback_position(guild_id: int) -> float:
+    """현재 곡의 재생 위치 (초)"""
+    session = guild_sessions.get(guild_id)
+    if not session or session.track_origin is None:
+        return 0.0
+    return time.monotonic() - session.track_origin
+
+def parse_duration(value):
+    """'1:02:03', '3:45', '90' 같은 길이 문자열을 초로 변환 (모르면 None)"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    parts = str(value).strip().split(':')
+    if not all(part.isdigit() for part in parts) or len(parts) > 3:
+        return None
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+def song_seconds(song_info: dict):
+    """곡 길이(초), 숫자로 저장된 값이 없으면 표시용 문자열에서 계산"""
+    seconds = song_info.get('duration_seconds')
+    return seconds if seconds is not None else parse_duration(song_info.get('duration'))
+
+def format_duration(seconds) -> str:
+    if seconds is None:
+        return 'N/A'
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+def reset_playback_modes(guild_id: int):
+    """반복/셔플 상태 초기화"""
+    session = guild_sessions.get(guild_id)
+    if session:
+        session.repeat = False
+        session.shuffle = False
+
+# 세션 클린업 작업
+async def cleanup_guild_sessions():
+    while True:
+        try:
+            now = time.monotonic()
+            for guild_id, session in list(guild_sessions.items()):
+                if not session.is_idle(now):
+                    continue
+                # 아직 음성 채널에 연결된 서버는 유지
+                guild = bot.get_guild(guild_id)
+                if guild and guild.voice_client:
+                    continue
+                session.close()
+                del guild_sessions[guild_id]
+
+            await asyncio.sleep(SESSION_CLEANUP_INTERVAL)
+        except Exception as e:
+            print(f"Session cleanup error: {e}")
+            await asyncio.sleep(SESSION_CLEANUP_INTERVAL)
+
+# 이벤트 루프 모니터 설정
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))  # 지연 측정 주기 (초)
+LOOP_LAG_SAMPLES = 1200  # 최근 10분치 샘플 유지
+SLOW_CALLBACK_THRESHOLD = float(os.getenv("SLOW_CALLBACK_THRESHOLD", "0.1"))  # 이 시간 이상 루프를 막으면 기록
+
+class LoopMonitor:
+    """이벤트 루프 지연 측정 + 루프를 오래 막는 코드 감지"""
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = collections.deque(maxlen=LOOP_LAG_SAMPLES)
+        self.max_lag = 0.0
+        self.slow_callbacks = collections.deque(maxlen=20)
+        self.slow_count = 0
+        self.loop = None
+        self._loop_thread_id = None
+        self._sampler = None
+
+    def start(self, loop):
+        if self._sampler:
+            return
+        self.loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._sampler = loop.create_task(self._sample())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    async def _sample(self):
+        """정해진 시간만큼 잔 뒤 실제로 얼마나 늦게 깨어났는지 측정"""
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            self.lags.append(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def _watch(self):
+        """별도 스레드에서 루프에 핑을 보내고, 응답이 늦으면 루프 스레드의 스택을 캡처"""
+        while not self.loop.is_closed():
+            pong = threading.Event()
+            sent = time.monotonic()
+            try:
+                self.loop.call_soon_threadsafe(pong.set)
+            except RuntimeError:
+                return  # 루프 종료됨
+
+            if pong.wait(self.threshold):
+                time.sleep(self.threshold)
+                continue
+
+            # 루프가 막혀 있는 동안 무엇을 실행 중인지 기록
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame else ''
+            task = asyncio.current_task(self.loop)
+            coro = task.get_coro() if task else None
+            pong.wait()
+            self._record_slow_callback(
+                getattr(coro, '__qualname__', repr(coro)),
+                stack,
+                time.monotonic() - sent
+            )
+
+    def _record_slow_callback(self, coroutine: str, stack: str, blocked: float):
+        self.slow_count += 1
+        self.slow_callbacks.append({
+            'coroutine': coroutine,
+            'blocked_ms': round(blocked * 1000, 1),
+            'at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'stack': stack
+        })
+        print(f"Slow callback: {coroutine} blocked the event loop for {blocked * 1000:.1f}ms\n{stack}")
+
+    def snapshot(self) -> dict:
+        lags = sorted(self.lags)
+
+        def percentile(p):
+            if not lags:
+                return 0.0
+            return lags[min(len(lags) - 1, int(len(lags) * p))]
+
+        return {
+            'samples': len(lags),
+            'p50_ms': round(percentile(0.50) * 1000, 2),
+            'p99_ms': round(percentile(0.99) * 1000, 2),
+            'max_ms': round(self.max_lag * 1000, 2),
+            'slow_callbacks': self.slow_count,
+            'threshold_ms': round(self.threshold * 1000, 1)
+        }
+
+    def dump(self) -> dict:
+        return {**self.snapshot(), 'recent_slow_callbacks': list(self.slow_callbacks)}
+
+loop_monitor = LoopMonitor(LOOP_LAG_INTERVAL, SLOW_CALLBACK_THRESHOLD)
+
+# 메트릭 설정 (Prometheus 텍스트 형식)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# 클러스터 워커는 기본 포트 + CLUSTER_ID로 따로 열림 (워커 0 = 9108, 워커 1 = 9109, ...)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # 0이면 비활성화
+if METRICS_PORT and CLUSTER_ID:
+    METRICS_PORT += int(CLUSTER_ID)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labelnames, values) -> str:
+    if not labelnames:
+        return ''
+    pairs = ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(labelnames, values))
+    return '{' + pairs + '}'
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            # [버킷별 개수..., 합계, 개수]
+            state = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        labelnames = self.labelnames + ('le',)
+        for key, state in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(labelnames, key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(labelnames, key + ('+Inf',))} {state[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {state[-2]}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+class MetricsRegistry:
+    """메트릭 모음 + /metrics HTTP 엔드포인트"""
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []  # 스크랩할 때마다 게이지 값을 채우는 함수들
+        self.server = None
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def on_collect(self, func):
+        self.collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception as e:
+                print(f"Metrics collector error: {e}")
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    async def start_server(self, host: str, port: int):
+        if self.server or not port:
+            return
+        self.server = await asyncio.start_server(self._handle_request, host, port)
+        print(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+
+    async def _handle_request(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # 헤더는 읽고 버림
+            while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self.render().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            else:
+                status, body, content_type = '404 Not Found', b'not found\n', 'text/plain'
 
-def set_current_playing_song(guild_id: int, song_info: dict):
-    current_playing[guild_id] = song_info
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+metrics = MetricsRegistry()
+
+EXTRACT_INFO_SECONDS = metrics.register(Histogram(
+    'miru_extract_info_seconds', 'yt-dlp extract_info latency', ['kind']))
+EXTRACTION_FAILURES = metrics.register(Counter(
+    'miru_extraction_failures_total', 'Failed yt-dlp extractions', ['kind']))
+TIME_TO_FIRST_AUDIO = metrics.register(Histogram(
+    'miru_time_to_first_audio_seconds', 'Time from user request to voice playback start'))
+PLAY_NEXT_GAP = metrics.register(Histogram(
+    'miru_play_next_gap_seconds', 'Silence between the end of a track and the start of the next'))
+DB_OPERATION_SECONDS = metrics.register(Histogram(
+    'miru_db_operation_seconds', 'SQLite operation latency', ['operation'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)))
+CACHE_REQUESTS = metrics.register(Counter(
+    'miru_cache_requests_total', 'Cache lookups', ['cache', 'result']))
+AUDIO_SOURCES = metrics.register(Counter(
+    'miru_audio_sources_total', 'Audio sources created by pipeline mode', ['mode']))
+EXTRACTIONS_REJECTED = metrics.register(Counter(
+    'miru_extractions_rejected_total', 'yt-dlp extractions rejected because the budget was full', ['scope']))
+RECOVERIES = metrics.register(Counter(
+    'miru_playback_recoveries_total', 'Stream/voice recovery attempts', ['reason', 'result']))
+ACTIVE_VOICE_CONNECTIONS = metrics.register(Gauge(
+    'miru_active_voice_connections', 'Connected voice clients'))
+GUILD_SESSIONS = metrics.register(Gauge(
+    'miru_guild_sessions', 'Live GuildSession objects'))
+LOOP_LAG_SECONDS = metrics.register(Gauge(
+    'miru_loop_lag_seconds', 'Event loop scheduling delay', ['quantile']))
+SLOW_CALLBACKS = metrics.register(Gauge(
+    'miru_slow_callbacks', 'Event loop blocks longer than the slow-callback threshold'))
+
+@metrics.on_collect
+def collect_runtime_metrics():
+    ACTIVE_VOICE_CONNECTIONS.set(len(bot.voice_clients))
+    GUILD_SESSIONS.set(len(guild_sessions))
+    stats = loop_monitor.snapshot()
+    LOOP_LAG_SECONDS.set(stats['p50_ms'] / 1000, quantile='0.5')
+    LOOP_LAG_SECONDS.set(stats['p99_ms'] / 1000, quantile='0.99')
+    LOOP_LAG_SECONDS.set(stats['max_ms'] / 1000, quantile='1')
+    SLOW_CALLBACKS.set(stats['slow_callbacks'])
+
+def db_timed(func):
+    """QueueDB 메서드 실행 시간 측정"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DB_OPERATION_SECONDS.observe(time.perf_counter() - started, operation=func.__name__)
+    return wrapper
 
 # YT-DLP 설정
 ytdl_format_options = {
-    'format': 'bestaudio/best',
-    'postprocessors': [{
-        'key': 'FFmpegExtractAudio',
-        'preferredcodec': 'opus',
-        'preferredquality': '192',
-    }],
+    # WebM 안의 Opus를 우선 선택 (디스코드 음성과 같은 코덱이라 다시 인코딩할 필요 없음)
+    'format': 'bestaudio[acodec=opus][ext=webm]/bestaudio[acodec=opus]/bestaudio/best',
     'nocheckcertificate': True,
     'ignoreerrors': False,
     'quiet': True,
@@ -198,24 +754,400 @@ FFMPEG_OPTIONS = {
     'options': '-vn'
 }
 
+# 재생 방식: passthrough(기본) = Opus 패킷을 그대로 전달, transcode = 항상 다시 인코딩
+PLAYBACK_MODE = os.getenv("PLAYBACK_MODE", "passthrough")
+PASSTHROUGH_GAIN_TOLERANCE_DB = 2.0  # 이 정도 음량 차이는 인코딩 없이 그대로 재생
+# 음량 평준화는 passthrough와 부딪힘: 게인을 적용하려면 다시 인코딩해야 함
+# (디스코드에는 Opus 패킷만 가서 Ogg 헤더의 output gain 같은 건 전달되지 않음)
+# 요즘 곡은 대부분 -8~-10 LUFS로 크게 마스터링돼서 목표(-14 LUFS)까지 4~6dB를 깎아야 하는데,
+# 이걸 다 적용하면 측정이 끝난 곡 대부분이 다시 인코딩됨 -> passthrough에서는 이 정도 줄이는 건 건너뜀
+# 0으로 두면 항상 평준화 (CPU 더 씀). 평준화 때문에 다시 인코딩한 수는 miru_audio_sources_total{mode="gain"}
+PASSTHROUGH_MAX_CUT_DB = float(os.getenv("PASSTHROUGH_MAX_CUT_DB", "6.0"))
+
 ytdl = yt_dlp.YoutubeDL(ytdl_format_options)
 
-async def get_audio_source(url: str, guild_id: int):
-    """음원 소스를 가져오는 함수 (캐싱 적용)"""
-    cache_key = f"source_{url}"
+# 봇 전체 추출 예산 (한 서버가 몰아서 요청해도 다른 서버 재생이 밀리지 않게)
+EXTRACTION_CONCURRENCY = 8  # 동시에 돌리는 검색/노래 정보/플레이리스트 추출 수
+EXTRACTION_MAX_WAITING = 64  # 이보다 많이 기다리고 있으면 새 요청은 바로 거절
+EXTRACTION_MAX_WAITING_PER_GUILD = 8  # 한 서버가 기다리게 할 수 있는 추출 수 (넘으면 그 서버 요청만 거절)
+# 재생용 추출(지금/다음 곡의 스트림 주소)은 거절하지 않고 따로 예약된 자리에서 실행
+# -> 다른 서버가 검색을 몰아서 해도 재생 중인 곡이 끊기지 않음
+PLAYBACK_EXTRACTION_CONCURRENCY = 4
+extraction_semaphore = asyncio.Semaphore(EXTRACTION_CONCURRENCY)
+playback_extraction_semaphore = asyncio.Semaphore(PLAYBACK_EXTRACTION_CONCURRENCY)
+# 기본 executor는 다른 작업과 같이 쓰고 스레드 수가 CPU 수에 따라 달라서 추출 전용으로 따로 둠
+extraction_executor = ThreadPoolExecutor(
+    max_workers=EXTRACTION_CONCURRENCY + PLAYBACK_EXTRACTION_CONCURRENCY,
+    thread_name_prefix='extract'
+)
+extraction_waiting = 0
+extraction_waiting_by_guild = {}
+
+async def acquire_extraction_slot(guild_id: int):
+    """검색/노래 정보 추출 자리 얻기 (대기열이 꽉 차면 바로 거절)"""
+    global extraction_waiting
+    if extraction_waiting >= EXTRACTION_MAX_WAITING:
+        EXTRACTIONS_REJECTED.inc(scope='global')
+        raise Exception("미루가 지금 너무 바빠... 조금 있다가 다시 해줘! 🥺")
+    guild_waiting = extraction_waiting_by_guild.get(guild_id, 0)
+    if guild_waiting >= EXTRACTION_MAX_WAITING_PER_GUILD:
+        EXTRACTIONS_REJECTED.inc(scope='guild')
+        raise Exception("이 서버에서 요청이 너무 많이 밀려있어... 조금 있다가 다시 해줘! 🥺")
+
+    extraction_waiting += 1
+    extraction_waiting_by_guild[guild_id] = guild_waiting + 1
+    try:
+        await extraction_semaphore.acquire()
+    finally:
+        extraction_waiting -= 1
+        extraction_waiting_by_guild[guild_id] -= 1
+        if not extraction_waiting_by_guild[guild_id]:
+            del extraction_waiting_by_guild[guild_id]
+
+async def extract_info(url: str, kind: str, guild_id: int):
+    """yt-dlp 정보 추출 (executor에서 실행 + 지연시간 측정)"""
+    if kind == 'audio_source':
+        semaphore = playback_extraction_semaphore
+        await semaphore.acquire()
+    else:
+        semaphore = extraction_semaphore
+        await acquire_extraction_slot(guild_id)
+
+    loop = asyncio.get_event_loop()
+    started = time.perf_counter()
+    try:
+        data = await loop.run_in_executor(extraction_executor, lambda: ytdl.extract_info(url, download=False))
+    except Exception:
+        EXTRACTION_FAILURES.inc(kind=kind)
+        raise
+    finally:
+        semaphore.release()
+        EXTRACT_INFO_SECONDS.observe(time.perf_counter() - started, kind=kind)
+    if not data:
+        EXTRACTION_FAILURES.inc(kind=kind)
+    return data
+
+# 음량 평준화 설정 (트랙별 통합 라우드니스를 한 번만 측정해서 고정 게인으로 적용)
+LOUDNESS_NORMALIZATION = os.getenv("LOUDNESS_NORMALIZATION", "1") != "0"
+LOUDNESS_TARGET_LUFS = -14.0
+LOUDNESS_MAX_BOOST_DB = 6.0  # 조용한 곡을 키우는 최대치 (클리핑 방지)
+LOUDNESS_MAX_CUT_DB = 12.0
+LOUDNESS_QUEUE_SIZE = 200  # 측정 대기열 크기 (넘치면 다음에 다시 요청됨)
+
+def get_track_id(data: dict):
+    """트랙 고유 ID (유튜브는 영상 ID, 그 외는 '추출기:ID')"""
+    extractor = data.get('extractor_key')
+    if not data.get('id') or extractor in (None, 'Generic'):
+        return None
+    if extractor == 'Youtube':
+        return data['id']
+    return f"{extractor}:{data['id']}"
+
+class LoudnessAnalyzer:
+    """백그라운드에서 FFmpeg loudnorm으로 트랙 라우드니스를 측정하고 DB에 저장"""
+    def __init__(self):
+        self.queue = None
+        self.pending = set()
+        self.cache = cachetools.LRUCache(maxsize=10000)  # track_id -> LUFS
+        self._worker = None
+
+    def get_lufs(self, track_id: str):
+        if track_id in self.cache:
+            return self.cache[track_id]
+        lufs = db.get_track_loudness(track_id)
+        if lufs is not None:
+            self.cache[track_id] = lufs
+        return lufs
+
+    def get_gain_db(self, track_id: str) -> float:
+        lufs = self.get_lufs(track_id) if track_id else None
+        if lufs is None:
+            return 0.0
+        gain = LOUDNESS_TARGET_LUFS - lufs
+        return max(-LOUDNESS_MAX_CUT_DB, min(LOUDNESS_MAX_BOOST_DB, gain))
+
+    def request(self, track_id: str, stream_url: str):
+        """측정 요청 (이미 측정했거나 대기 중이면 무시)"""
+        if not track_id or track_id in self.pending or self.get_lufs(track_id) is not None:
+            return
+        if self.queue is None:
+            self.queue = asyncio.Queue(maxsize=LOUDNESS_QUEUE_SIZE)
+            self._worker = asyncio.create_task(self._run())
+        try:
+            self.queue.put_nowait((track_id, stream_url))
+            self.pending.add(track_id)
+        except asyncio.QueueFull:
+            pass
+
+    async def _run(self):
+        # 측정은 한 번에 하나씩만 (재생 중인 FFmpeg와 CPU를 나눠 씀)
+        while True:
+            track_id, stream_url = await self.queue.get()
+            try:
+                lufs = await self.measure(stream_url)
+                if lufs is not None:
+                    self.cache[track_id] = lufs
+                    db.save_track_loudness(track_id, lufs)
+            except Exception as e:
+                print(f"Loudness analysis error for {track_id}: {e}")
+            finally:
+                self.pending.discard(track_id)
+
+    async def measure(self, stream_url: str):
+        process = await asyncio.create_subprocess_exec(
+            'ffmpeg', '-nostdin', '-hide_banner', '-nostats', '-threads', '1',
+            *FFMPEG_OPTIONS['before_options'].split(),
+            '-i', stream_url, '-vn', '-sn',
+            '-af', 'loudnorm=print_format=json', '-f', 'null', '-',
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await process.communicate()
+        output = stderr.decode('utf-8', errors='ignore')
+        start = output.rfind('{')
+        end = output.rfind('}')
+        if process.returncode != 0 or start == -1 or end < start:
+            return None
+        input_i = float(json.loads(output[start:end + 1])['input_i'])
+        # 무음 트랙은 -inf로 나옴
+        return input_i if math.isfinite(input_i) else None
+
+loudness_analyzer = LoudnessAnalyzer()
+
+def get_playback_gain_db(track_id: str, guild_id: int, acodec=None) -> float:
+    """트랙 라우드니스 보정 + 서버 볼륨 설정을 합친 게인(dB)"""
+    gain = loudness_analyzer.get_gain_db(track_id) if LOUDNESS_NORMALIZATION else 0.0
+    if PLAYBACK_MODE == 'passthrough' and acodec == 'opus' and -PASSTHROUGH_MAX_CUT_DB <= gain < 0:
+        # 조금 큰 Opus 곡은 줄이지 않고 인코딩 없이 재생 (어차피 인코딩하는 곡, 조용한 곡 키우기, 서버 볼륨은 그대로 적용)
+        gain = 0.0
+    volume = db.get_guild_settings(guild_id).volume or 1.0
+    if volume != 1.0:
+        gain += 20 * math.log10(max(volume, 0.01))
+    return gain
+
+async def resolve_stream(url: str, guild_id: int) -> dict:
+    """스트림 주소와 코덱을 가져오는 함수 (캐싱 적용)"""
+    # FFmpeg 소스 객체는 한 번 재생하면 끝이라 캐시하지 않고, 스트림 정보만 캐시함
+    cache_key = f"stream_{url}"
     guild_cache = get_guild_cache(guild_id)
     if cache_key in guild_cache.url_cache:
+        CACHE_REQUESTS.inc(cache='audio_source', result='hit')
         return guild_cache.url_cache[cache_key]
+    CACHE_REQUESTS.inc(cache='audio_source', result='miss')
+
+    data = await extract_info(url, 'audio_source', guild_id)
+    if not data:
+        raise Exception("미루는 이 오디오 소스를 찾을 수 없어...")
+
+    stream = {
+        'stream_url': data['url'],
+        'acodec': data.get('acodec'),
+        'track_id': get_track_id(data)
+    }
+    guild_cache.url_cache[cache_key] = stream
+    return stream
+
+def invalidate_stream(url: str, guild_id: int):
+    """만료된 스트림 주소를 캐시에서 제거"""
+    get_guild_cache(guild_id).url_cache.pop(f"stream_{url}", None)
+
+async def create_audio_source(stream_url: str, acodec, gain_db: float, before_options: str = None):
+    """재생 방식과 코덱에 맞는 FFmpeg 소스 생성"""
+    if before_options is None:
+        before_options = FFMPEG_OPTIONS['before_options']
+
+    # Opus면 디먹싱만 하고 패킷을 그대로 전달 (인코딩 없음)
+    # nextcord는 codec이 'opus'/'libopus'일 때만 -c:a copy를 쓰고, 그 외('copy' 포함)는 전부 libopus로 다시 인코딩함
+    if PLAYBACK_MODE == 'passthrough' and acodec == 'opus' and abs(gain_db) < PASSTHROUGH_GAIN_TOLERANCE_DB:
+        AUDIO_SOURCES.inc(mode='passthrough')
+        return nextcord.FFmpegOpusAudio(
+            stream_url,
+            codec='opus',
+            before_options=before_options,
+            options=FFMPEG_OPTIONS['options']
+        )
 
-    loop = asyncio.get_event_loop()
+    # 코덱을 모르면 프로브해서 결정
+    if not acodec and abs(gain_db) < 0.5:
+        AUDIO_SOURCES.inc(mode='probe')
+        return await nextcord.FFmpegOpusAudio.from_probe(
+            stream_url,
+            before_options=before_options,
+            options=FFMPEG_OPTIONS['options']
+        )
+
+    # Opus가 아니거나 게인을 적용해야 하면 다시 인코딩
+    # (gain = passthrough할 수 있는 Opus인데 음량 때문에 다시 인코딩한 경우)
+    AUDIO_SOURCES.inc(mode='gain' if PLAYBACK_MODE == 'passthrough' and acodec == 'opus' else 'transcode')
+    options = FFMPEG_OPTIONS['options']
+    if abs(gain_db) >= 0.5:
+        options += f" -af volume={gain_db:.2f}dB"
+    return nextcord.FFmpegOpusAudio(stream_url, before_options=before_options, options=options)
+
+# 인기 곡 로컬 캐시 (AUDIO_CACHE_DIR를 지정하면 켜짐)
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR")
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_MB", "2048")) * 1024 * 1024
+AUDIO_CACHE_MIN_PLAYS = int(os.getenv("AUDIO_CACHE_MIN_PLAYS", "3"))  # 이만큼 재생된 곡부터 저장
+AUDIO_CACHE_MAX_TRACK_BYTES = 30 * 1024 * 1024  # 라이브/너무 긴 영상은 저장하지 않음
+AUDIO_CACHE_DOWNLOADS = 2  # 동시에 받는 곡 수
+AUDIO_CACHE_STALE_TMP = 3600  # 이보다 오래된 .tmp는 중간에 끊긴 다운로드로 보고 지움 (초)
+
+YOUTUBE_ID_PATTERN = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/)([\w-]{11})')
+
+def get_track_id_from_url(url: str):
+    """추출 없이 주소만 보고 유튜브 영상 ID 알아내기"""
+    match = YOUTUBE_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+class AudioCache:
+    """자주 재생되는 곡의 Opus 오디오를 디스크에 저장 (용량 제한 LRU)"""
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()  # 파일 키 -> 크기 (오래 안 쓴 순서)
+        self.total_bytes = 0
+        self.play_counts = cachetools.LRUCache(maxsize=50000)
+        self.downloading = set()
+        self.semaphore = asyncio.Semaphore(AUDIO_CACHE_DOWNLOADS)
+        if directory:
+            self.load_index()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    @staticmethod
+    def file_key(track_id: str) -> str:
+        return hashlib.sha1(track_id.encode('utf-8')).hexdigest()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.opus")
+
+    def load_index(self):
+        """재시작 후에도 캐시를 이어 쓰도록 디렉터리를 훑어서 인덱스 생성"""
+        os.makedirs(self.directory, exist_ok=True)
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            # 다른 워커가 받고 있는 중일 수 있으므로 오래된 것만 지움
+            if entry.name.endswith('.tmp') and now - entry.stat().st_mtime > AUDIO_CACHE_STALE_TMP:
+                os.remove(entry.path)
+        self.scan()
+        self.evict()
+
+    def scan(self):
+        """디렉터리는 클러스터 워커끼리 공유하므로 다른 워커가 받거나 지운 파일까지 포함해서
+        인덱스와 총 용량을 디스크 기준으로 다시 계산 (mtime 순 = 모든 워커 기준 오래 안 쓴 순서)"""
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.opus'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, entry.name[:-5], stat.st_size))
+        self.entries = collections.OrderedDict((key, size) for _, key, size in sorted(files))
+        self.total_bytes = sum(self.entries.values())
+
+    def lookup(self, track_id: str):
+        if not self.enabled or not track_id:
+            return None
+        key = self.file_key(track_id)
+        if key not in self.entries:
+            CACHE_REQUESTS.inc(cache='audio_file', result='miss')
+            return None
+        path = self.path_for(key)
+        try:
+            os.utime(path)  # 재시작 후 LRU 순서를 위해 mtime 갱신
+        except FileNotFoundError:
+            # 다른 워커가 지웠음
+            self.total_bytes -= self.entries.pop(key)
+            CACHE_REQUESTS.inc(cache='audio_file', result='miss')
+            return None
+        self.entries.move_to_end(key)
+        CACHE_REQUESTS.inc(cache='audio_file', result='hit')
+        return path
+
+    def record_play(self, track_id: str, stream_url: str, acodec):
+        """재생 횟수를 세고 충분히 인기 있으면 백그라운드로 저장"""
+        if not self.enabled or not track_id or acodec != 'opus':
+            return
+        count = self.play_counts.get(track_id, 0) + 1
+        self.play_counts[track_id] = count
+        key = self.file_key(track_id)
+        if count >= AUDIO_CACHE_MIN_PLAYS and key not in self.entries and key not in self.downloading:
+            self.downloading.add(key)
+            asyncio.create_task(self.download(key, stream_url))
+
+    async def download(self, key: str, stream_url: str):
+        path = self.path_for(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            async with self.semaphore:
+                process = await asyncio.create_subprocess_exec(
+                    'ffmpeg', '-nostdin', '-loglevel', 'error', '-y',
+                    *FFMPEG_OPTIONS['before_options'].split(),
+                    '-i', stream_url, '-vn', '-c:a', 'copy', '-f', 'opus',
+                    '-fs', str(AUDIO_CACHE_MAX_TRACK_BYTES), tmp_path,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL
+                )
+                await process.wait()
+
+            size = os.path.getsize(tmp_path) if os.path.exists(tmp_path) else 0
+            if process.returncode != 0 or size == 0 or size >= AUDIO_CACHE_MAX_TRACK_BYTES:
+                return
+            # 다 받은 파일만 원자적으로 교체해서 반쯤 쓰인 파일을 재생하는 일이 없게 함
+            os.replace(tmp_path, path)
+            self.scan()
+            self.evict()
+        except Exception as e:
+            print(f"Audio cache download error: {e}")
+        finally:
+            self.downloading.discard(key)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def evict(self):
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+
+audio_cache = AudioCache(AUDIO_CACHE_DIR, AUDIO_CACHE_MAX_BYTES)
+
+def seek_options(before_options: str, offset: float) -> str:
+    """-ss를 입력(-i) 앞에 둬서 디코딩 없이 바로 해당 위치로 이동"""
+    if offset <= 0:
+        return before_options
+    return f"-ss {offset:.2f} {before_options}".strip()
+
+async def get_audio_source(url: str, guild_id: int, offset: float = 0.0):
+    """음원 소스를 가져오는 함수 (캐싱 적용, offset초부터 재생)"""
     try:
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=False))
-        if not data:
-            raise Exception("미루는 이 오디오 소스를 찾을 수 없어...")
-        
-        source = await nextcord.FFmpegOpusAudio.from_probe(data['url'], **FFMPEG_OPTIONS)
-        guild_cache.url_cache[cache_key] = source
-        return source
+        # 로컬에 저장된 인기 곡은 추출 없이 바로 파일에서 재생
+        track_id = get_track_id_from_url(url)
+        cached_path = audio_cache.lookup(track_id)
+        if cached_path:
+            gain_db = get_playback_gain_db(track_id, guild_id, 'opus')
+            return await create_audio_source(
+                cached_path, 'opus', gain_db,
+                before_options=seek_options('', offset)
+            )
+
+        stream = await resolve_stream(url, guild_id)
+        audio_cache.record_play(stream['track_id'], stream['stream_url'], stream['acodec'])
+        if LOUDNESS_NORMALIZATION:
+            loudness_analyzer.request(stream['track_id'], stream['stream_url'])
+
+        gain_db = get_playback_gain_db(stream['track_id'], guild_id, stream['acodec'])
+        return await create_audio_source(
+            stream['stream_url'], stream['acodec'], gain_db,
+            before_options=seek_options(FFMPEG_OPTIONS['before_options'], offset)
+        )
     except Exception as e:
         print(f"Error getting audio source: {e}")
         raise
@@ -224,22 +1156,36 @@ async def get_song_info(url: str, guild_id: int) -> dict:
     """노래 정보를 가져오는 함수 (캐싱 적용)"""
     guild_cache = get_guild_cache(guild_id)
     if url in guild_cache.song_cache:
+        CACHE_REQUESTS.inc(cache='song_info', result='hit')
         return guild_cache.song_cache[url]
 
-    loop = asyncio.get_event_loop()
+    # 클러스터 공유 캐시 확인
+    if cluster:
+        song_info = await cluster.cache_get('track', url)
+        if song_info:
+            CACHE_REQUESTS.inc(cache='cluster_track', result='hit')
+            guild_cache.song_cache[url] = song_info
+            return song_info
+        CACHE_REQUESTS.inc(cache='cluster_track', result='miss')
+    CACHE_REQUESTS.inc(cache='song_info', result='miss')
+
     try:
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=False))
+        data = await extract_info(url, 'song_info', guild_id)
         if not data:
             raise Exception("미루는 이 노래 정보를 찾을 수 없어...")
         
         song_info = {
-            'url': data['url'],
+            # 스트림 주소는 몇 시간 뒤 만료되므로 영상 페이지 주소를 저장
+            'url': data.get('webpage_url') or url,
             'title': data['title'],
             'duration': data.get('duration_string', 'N/A'),
+            'duration_seconds': parse_duration(data.get('duration')),
             'channel': data.get('uploader', 'N/A'),
             'thumbnail': data.get('thumbnail')
         }
         guild_cache.song_cache[url] = song_info
+        if cluster:
+            await cluster.cache_set('track', url, song_info)
         return song_info
     except Exception as e:
         print(f"Error getting song info: {e}")
@@ -249,52 +1195,397 @@ class PlayManager:
     """재생 관리 클래스"""
     def __init__(self, bot):
         self.bot = bot
-        self.play_locks = {}
     
-    async def get_lock(self, guild_id: int):
-        if guild_id not in self.play_locks:
-            self.play_locks[guild_id] = asyncio.Lock()
-        return self.play_locks[guild_id]
+    async def play_song(self, voice_client, song_info, guild_id, after_callback, requested_at=None, offset=0.0):
+        """곡 재생 시작 (실패하면 예외를 그대로 올려보냄)"""
+        source = await get_audio_source(song_info['url'], guild_id, offset)
+        voice_client.play(source, after=after_callback)
+        set_current_playing_song(guild_id, song_info, offset)
+        get_session(guild_id).voice_channel_id = voice_client.channel.id
+        if requested_at is not None:
+            TIME_TO_FIRST_AUDIO.observe(time.perf_counter() - requested_at)
+        return True
 
-    async def play_song(self, voice_client, song_info, guild_id, after_callback):
-        try:
-            source = await get_audio_source(song_info['url'], guild_id)
-            voice_client.play(source, after=after_callback)
-            return True
-        except Exception as e:
-            print(f"Error playing song: {e}")
-            return False
+    async def seek(self, voice_client, guild_id: int, position: float) -> float:
+        """현재 곡을 position초부터 재생 (소스만 바꿔서 after 콜백이 불리지 않음)"""
+        song_info = get_current_playing_song(guild_id)
+        if not song_info or not voice_client or not (voice_client.is_playing() or voice_client.is_paused()):
+            raise Exception("❌ 현재 재생 중인 노래가 없어..!")
+
+        duration = song_seconds(song_info)
+        position = max(0.0, position)
+        if duration:
+            position = min(position, max(duration - 1, 0))
+
+        source = await get_audio_source(song_info['url'], guild_id, position)
+        old_source = voice_client.source
+        voice_client.source = source
+        if old_source:
+            old_source.cleanup()
+        set_current_playing_song(guild_id, song_info, position)
+        return position
 
 play_manager = PlayManager(bot)
 
+def make_after_callback(guild_id: int, message):
+    """곡이 끝나면 서버 플레이어에 알려주는 콜백 (음성 스레드에서 호출됨)"""
+    player = get_player(guild_id, message)
+    def after_playing(error):
+        if error:
+            print(f"Error playing song: {error}")
+        player.post_threadsafe('track_end', error=error, ended_at=time.perf_counter())
+    return after_playing
+
+# 스트림 복구 설정
+RECOVERY_MAX_ATTEMPTS = 3  # 한 번 끊겼을 때 다시 시도하는 횟수
+RECOVERY_MAX_PER_TRACK = 3  # 한 곡에서 복구하는 최대 횟수
+RECOVERY_END_TOLERANCE = 5  # 곡 길이보다 이만큼(초) 일찍 끝나면 비정상 종료로 판단
+
+class StreamRecovery:
+    """스트림 만료/음성 연결 끊김을 정상 종료와 구분해서 끊긴 위치부터 다시 재생"""
+    def failure_reason(self, session: GuildSession, error, voice_client):
+        if session.stop_requested or not session.current_song:
+            return None
+        if error:
+            return 'error'
+        if not voice_client or not voice_client.is_connected():
+            return 'voice'
+        duration = song_seconds(session.current_song)
+        position = time.monotonic() - session.track_origin if session.track_origin else 0
+        # 스트림 주소가 만료되면 FFmpeg가 에러 없이 일찍 끝나버림
+        if duration and position < duration - RECOVERY_END_TOLERANCE:
+            return 'stream'
+        return None
+
+    async def reconnect(self, session: GuildSession, guild):
+        voice_client = guild.voice_client
+        if voice_client and voice_client.is_connected():
+            return voice_client
+        if voice_client:
+            await voice_client.disconnect(force=True)
+        channel = guild.get_channel(session.voice_channel_id) if session.voice_channel_id else None
+        if not channel:
+            raise Exception("미루가 들어가 있던 음성 채널을 찾을 수 없어...")
+        return await session.voice_state.connect_with_retry(channel)
+
+    async def try_recover(self, guild_id: int, message, error) -> bool:
+        """복구했거나 더 할 일이 없으면 True, 다음 곡으로 넘어가야 하면 False"""
+        session = guild_sessions.get(guild_id)
+        if not session:
+            return False
+        reason = self.failure_reason(session, error, message.guild.voice_client)
+        if not reason:
+            return False
+        if session.recoveries >= RECOVERY_MAX_PER_TRACK:
+            RECOVERIES.inc(reason=reason, result='gave_up')
+            return False
+
+        session.recoveries += 1
+        song_info = session.current_song
+        position = get_playback_position(guild_id)
+        print(f"Recovering playback in guild {guild_id} ({reason}) at {position:.1f}s")
+
+        for attempt in range(RECOVERY_MAX_ATTEMPTS):
+            if session.stop_requested:
+                return True
+            try:
+                voice_client = await self.reconnect(session, message.guild)
+                if session.stop_requested:
+                    # 다시 연결하는 사이에 스킵/나가기를 누름 -> 그 명령이 이어서 처리함
+                    return True
+                # 만료됐을 수 있는 스트림 주소는 버리고 새로 추출
+                invalidate_stream(song_info['url'], guild_id)
+                await play_manager.play_song(
+                    voice_client, song_info, guild_id,
+                    make_after_callback(guild_id, message),
+                    offset=position
+                )
+                RECOVERIES.inc(reason=reason, result='success')
+                return True
+            except Exception as e:
+                print(f"Recovery attempt {attempt + 1} failed in guild {guild_id}: {e}")
+                await asyncio.sleep(2 ** attempt)
+
+        RECOVERIES.inc(reason=reason, result='failed')
+        return False
+
+stream_recovery = StreamRecovery()
+
+PLAYER_MAX_SKIPS = 5  # 곡 전환 한 번에 건너뛸 수 있는 재생 실패 곡 수
+
+class GuildPlayer:
+    """서버별 재생 상태 머신
+
+    곡 종료, 스킵, 정지, 재생, 위치 이동을 모두 명령 큐로 받아서 태스크 하나가 순서대로 처리함
+    (재귀 호출이나 락 중첩 없이 곡 전환이 한 번에 하나씩만 일어남)
+    """
+    IDLE = 'idle'
+    PLAYING = 'playing'
+    STOPPED = 'stopped'
+
+    def __init__(self, guild_id: int, message):
+        self.guild_id = guild_id
+        self.message = message
+        self.state = self.IDLE
+        self.commands = asyncio.Queue()
+        self.task = None
+
+    def ensure_running(self):
+        if self.task is None or self.task.done():
+            self.task = bot.loop.create_task(self.run())
+
+    def post(self, command: str, future=None, **payload):
+        self.ensure_running()
+        self.commands.put_nowait((command, payload, future))
+
+    def post_threadsafe(self, command: str, **payload):
+        """음성 스레드 같은 다른 스레드에서 명령 보내기"""
+        bot.loop.call_soon_threadsafe(functools.partial(self.post, command, **payload))
+
+    async def request(self, command: str, **payload):
+        """명령을 보내고 처리 결과를 기다림 (실패하면 예외가 그대로 올라옴)"""
+        future = bot.loop.create_future()
+        self.post(command, future, **payload)
+        return await future
+
+    def close(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while True:
+            command, payload, future = await self.commands.get()
+            try:
+                async with get_session(self.guild_id).play_lock:
+                    result = await getattr(self, f'on_{command}')(**payload)
+                if future and not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if future and not future.done():
+                    future.set_exception(e)
+                else:
+                    print(f"Player error in guild {self.guild_id} ({command}): {e}")
+
+    async def on_play(self, voice_client, song_info, requested_at=None):
+        """유저가 고른 곡 재생 -> (바로 재생했는지, 재생목록 위치)
+        그사이 다른 곡이 먼저 시작됐으면 재생목록에 추가하고 (False, 위치)를 돌려줌"""
+        # 넘겨받은 voice_client는 곡 정보를 가져오기 전에 잡아둔 거라
+        # 그사이 나가기/자동 퇴장으로 끊겼을 수 있음 -> 지금 연결을 다시 확인하고 끊겼으면 다시 들어감
+        current = self.message.guild.voice_client
+        if current and current.is_connected():
+            voice_client = current
+        else:
+            if current:
+                await current.disconnect(force=True)
+            voice_client = await get_session(self.guild_id).voice_state.connect_with_retry(voice_client.channel)
+
+        if voice_client.is_playing() or voice_client.is_paused():
+            return False, db.add_to_queue(self.guild_id, song_info)
+        await play_manager.play_song(
+            voice_client, song_info, self.guild_id,
+            make_after_callback(self.guild_id, self.message),
+            requested_at=requested_at
+        )
+        self.state = self.PLAYING
+        return True, None
+
+    async def on_seek(self, voice_client, position: float):
+        return await play_manager.seek(voice_client, self.guild_id, position)
+
+    async def on_skip(self, song=None):
+        """song: 스킵 버튼을 눌렀을 때 재생 중이던 곡 (그새 다른 곡으로 넘어갔으면 무시)"""
+        if song is not None and get_current_playing_song(self.guild_id) is not song:
+            return
+        voice_client = self.message.guild.voice_client
+        mark_stop_requested(self.guild_id)
+        if voice_client and (voice_client.is_playing() or voice_client.is_paused()):
+            # 멈추면 after 콜백이 track_end를 보내서 다음 곡으로 넘어감
+            voice_client.stop()
+        else:
+            # 복구하던 중에 스킵해서 재생 중인 곡이 없음
+            await self.advance()
+
+    async def on_stop(self, voice_client):
+        """음성 채널에서 나가고 재생 상태 초기화"""
+        self.state = self.STOPPED
+        mark_stop_requested(self.guild_id)
+        if voice_client and voice_client.is_connected():
+            await voice_client.disconnect()
+        clear_current_playing_song(self.guild_id)
+        db.clear_guild_queue(self.guild_id)
+        reset_playback_modes(self.guild_id)
+
+    async def on_track_end(self, error=None, ended_at=None):
+        """곡이 끝났을 때 복구가 필요한지 먼저 보고, 아니면 다음 곡 재생"""
+        voice_client = self.message.guild.voice_client
+        if voice_client and (voice_client.is_playing() or voice_client.is_paused()):
+            # 끝난 곡의 알림이 다른 곡이 시작된 뒤에 도착함 (스킵 처리 중 다음 곡 재생 등)
+            return
+        if await stream_recovery.try_recover(self.guild_id, self.message, error):
+            return
+        voice_client = self.message.guild.voice_client
+        session = guild_sessions.get(self.guild_id)
+        if session and not session.stop_requested and (not voice_client or not voice_client.is_connected()):
+            # 음성 연결을 되살리지 못함
+            self.state = self.STOPPED
+            await handle_play_error(self.guild_id, self.message)
+            return
+        await self.advance(ended_at)
+
+    async def advance(self, ended_at=None):
+        """다음 곡 재생 (실패한 곡은 PLAYER_MAX_SKIPS개까지 건너뜀)"""
+        guild_id = self.guild_id
+        message = self.message
+        voice_client = message.guild.voice_client
+        if not voice_client or not voice_client.is_connected():
+            self.state = self.IDLE
+            return
+        if voice_client.is_playing() or voice_client.is_paused():
+            # 곡이 끝난 직후 들어온 재생 요청이 먼저 처리됨 -> 재생목록은 그 곡이 끝난 뒤에 이어감
+            return
+
+        # 반복 재생이면 방금 끝난 곡을 맨 뒤에 다시 넣음
+        current_song = get_current_playing_song(guild_id)
+        if get_repeat_state(guild_id) and current_song:
+            db.add_to_queue(guild_id, current_song, enforce_limit=False)  # 반복 재생은 한도와 상관없이 다시 넣음
+            if get_shuffle_state(guild_id):
+                db.shuffle_queue(guild_id)
+
+        for _ in range(PLAYER_MAX_SKIPS):
+            next_song = db.get_next_song(guild_id)
+            if not next_song:
+                # 재생목록이 끝남
+                self.state = self.STOPPED
+                await get_voice_state(guild_id).handle_disconnect(voice_client, message)
+                clear_current_playing_song(guild_id)
+                db.clear_guild_queue(guild_id)
+                return
+
+            try:
+                await play_manager.play_song(
+                    voice_client, next_song, guild_id,
+                    make_after_callback(guild_id, message)
+                )
+            except Exception as e:
+                print(f"Error playing next song in guild {guild_id}: {e}")
+                continue
+
+            self.state = self.PLAYING
+            if ended_at is not None:
+                PLAY_NEXT_GAP.observe(time.perf_counter() - ended_at)
+            try:
+                await message.edit(embed=create_playing_embed(next_song, guild_id), view=PlayingView(message, next_song))
+            except nextcord.HTTPException as e:
+                print(f"Failed to update player message: {e}")
+            # 음성 채널 타이머 시작
+            await get_voice_state(guild_id).start_timer(voice_client, message)
+            return
+
+        # 연속으로 재생에 실패함
+        self.state = self.STOPPED
+        await handle_play_error(guild_id, message)
+
+def get_player(guild_id: int, message=None) -> GuildPlayer:
+    """서버 플레이어 (message를 넘기면 플레이어 메시지도 갱신)"""
+    session = get_session(guild_id)
+    if session.player is None:
+        session.player = GuildPlayer(guild_id, message)
+    elif message is not None:
+        session.player.message = message
+    return session.player
+
+class SavedQueueImportError(Exception):
+    """재생목록 가져오기가 중간에 실패함 (imported/skipped는 이미 커밋된 수)"""
+    def __init__(self, imported: int, skipped: int, line_number: int, error: Exception):
+        super().__init__(
+            f"line {line_number}: {error} ({imported} imported and {skipped} skipped before it were "
+            f"committed; run the import again to continue)"
+        )
+        self.imported = imported
+        self.skipped = skipped
+        self.line_number = line_number
+
+class QueueFullError(Exception):
+    """서버 재생목록이 max_queue_size에 도달함"""
+    def __init__(self, max_size: int):
+        super().__init__(f"재생목록이 꽉 찼어... (최대 {max_size}곡) 곡이 좀 줄어들면 다시 추가해줘!")
+        self.max_size = max_size
+
+class EnqueueRateLimitedError(Exception):
+    """유저가 곡을 너무 빨리 연달아 추가함"""
+    def __init__(self):
+        super().__init__("너무 빨라..! 조금만 천천히 추가해줘!")
+
+# 유저별 곡 추가 요청 제한 (토큰 버킷)
+# 검색창을 열 때가 아니라 실제로 곡을 추가할 때 차감 (링크/플레이리스트/저장된 재생목록은 한 번, 검색 결과는 고를 때)
+ENQUEUE_BURST = 5  # 한 번에 연달아 할 수 있는 요청 수
+ENQUEUE_REFILL_SECONDS = 6  # 요청 하나가 다시 채워지는 시간
+
+class EnqueueRateLimiter:
+    def __init__(self):
+        # user_id -> (남은 토큰, 마지막 갱신 시각), 다 채워질 시간이 지나면 자동으로 사라짐
+        self.buckets = cachetools.TTLCache(maxsize=10000, ttl=ENQUEUE_BURST * ENQUEUE_REFILL_SECONDS)
+
+    def allow(self, user_id: int) -> bool:
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(user_id, (ENQUEUE_BURST, now))
+        tokens = min(ENQUEUE_BURST, tokens + (now - updated) / ENQUEUE_REFILL_SECONDS)
+        if tokens < 1:
+            self.buckets[user_id] = (tokens, now)
+            return False
+        self.buckets[user_id] = (tokens - 1, now)
+        return True
+
+    def charge(self, user_id: int):
+        """곡 추가 한 번 차감 (토큰이 없으면 EnqueueRateLimitedError)"""
+        if not self.allow(user_id):
+            raise EnqueueRateLimitedError()
+
+enqueue_limiter = EnqueueRateLimiter()
+
 class GuildSettings:
     def __init__(self, guild_id: int):
         self.guild_id = guild_id
+        self.music_channel_id = None
         self.volume = 1.0
         self.dj_role_id = None
         self.max_queue_size = 500
+        self.chat_enabled = None  # None이면 CHAT_OPT_IN 기본값을 따름
         self.last_updated = datetime.now()
 
     @classmethod
     def from_db(cls, db_data):
         instance = cls(db_data['guild_id'])
+        instance.music_channel_id = db_data.get('music_channel_id')
         instance.volume = db_data.get('volume', 1.0)
         instance.dj_role_id = db_data.get('dj_role_id')
         instance.max_queue_size = db_data.get('max_queue_size', 500)
+        instance.chat_enabled = db_data.get('chat_enabled')
         return instance
 
+DB_PATH = os.getenv("MUSIC_DB_PATH", "music_queue.db")
+GUILD_SETTINGS_CACHE_SIZE = 10000
+
 class QueueDB:
     def __init__(self):
         self._connection = None
         self._cursor = None
+        self.music_players = {}  # guild_id -> (channel_id, message_id), 테이블과 항상 같은 내용
+        self.queue_counts = {}  # guild_id -> 재생목록 곡 수 (queue를 바꾸는 메서드에서 같이 갱신)
+        self.queue_durations = {}  # guild_id -> 재생목록 전체 길이(초), 길이를 모르는 곡은 빼고 계산
+        # guild_id -> GuildSettings, 처음 조회할 때 읽고 설정을 바꾸는 메서드에서 같이 갱신
+        self.settings_cache = cachetools.LRUCache(maxsize=GUILD_SETTINGS_CACHE_SIZE)
         self.setup()
     
     @property
     def conn(self):
         if self._connection is None:
-            self._connection = sqlite3.connect('music_queue.db', 
-                isolation_level=None)  # 자동 커밋 모드
+            self._connection = sqlite3.connect(DB_PATH, 
+                isolation_level=None,  # 자동 커밋 모드
+                timeout=10)  # 클러스터 워커끼리 같은 DB 파일을 공유함
             self._connection.row_factory = sqlite3.Row
+            self._connection.execute('PRAGMA journal_mode=WAL')
         return self._connection
     
     @property
@@ -317,6 +1608,9 @@ class QueueDB:
                 position INTEGER NOT NULL
             )
         ''')
+        self.c.execute('''
+            CREATE INDEX IF NOT EXISTS idx_queue_guild_position ON queue (guild_id, position)
+        ''')
         
         # 서버별 설정 테이블
         self.c.execute('''
@@ -353,6 +1647,15 @@ class QueueDB:
             )
         ''')
         
+        # 트랙별 라우드니스 측정 결과
+        self.c.execute('''
+            CREATE TABLE IF NOT EXISTS track_loudness (
+                track_id TEXT PRIMARY KEY,
+                integrated_lufs REAL NOT NULL,
+                measured_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
         # 음악 플레이어 메시지 저장용 테이블 추가
         self.c.execute('''
             CREATE TABLE IF NOT EXISTS music_players (
@@ -373,16 +1676,56 @@ class QueueDB:
             )
         ''')
 
+        # guild_settings는 위의 첫 번째 정의로 먼저 만들어지기 때문에 빠진 컬럼을 추가
+        self.ensure_columns('guild_settings', {
+            'volume': 'REAL DEFAULT 1.0',
+            'dj_role_id': 'INTEGER',
+            'max_queue_size': 'INTEGER DEFAULT 500',
+            'last_updated': 'TIMESTAMP',
+            'chat_enabled': 'INTEGER'
+        })
+        # 불러올 때 유저 정보를 API로 조회하지 않도록 저장 당시 이름을 같이 기록
+        self.ensure_columns('saved_queues', {
+            'creator_name': 'TEXT'
+        })
+
+        # 길이를 초 단위 숫자로도 저장 (전체 재생 시간/대기 시간 계산용), 기존 곡은 문자열에서 변환
+        self.conn.create_function('parse_duration', 1, parse_duration, deterministic=True)
+        for table in ('queue', 'saved_queue_songs'):
+            if self.ensure_columns(table, {'duration_seconds': 'INTEGER'}):
+                self.c.execute(f'UPDATE {table} SET duration_seconds = parse_duration(duration)')
+
         self.conn.commit()
-        self.clear_all_queues()
-    def add_to_queue(self, guild_id: int, song_info: dict):
+        self.load_music_players()
+
+    def ensure_columns(self, table: str, columns: dict):
+        """기존 DB에 없는 컬럼 추가 (간단한 마이그레이션)"""
+        self.c.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in self.c.fetchall()}
+        added = []
+        for name, definition in columns.items():
+            if name not in existing:
+                self.c.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+                added.append(name)
+        return added
+
+    def get_queue_capacity(self, guild_id: int) -> int:
+        """재생목록에 더 넣을 수 있는 곡 수"""
+        max_size = self.get_guild_settings(guild_id).max_queue_size or 500
+        return max(0, max_size - self.get_queue_length(guild_id))
+
+    @db_timed
+    def add_to_queue(self, guild_id: int, song_info: dict, enforce_limit: bool = True):
+        if enforce_limit and self.get_queue_capacity(guild_id) <= 0:
+            raise QueueFullError(self.get_guild_settings(guild_id).max_queue_size or 500)
+
         self.c.execute('SELECT MAX(position) FROM queue WHERE guild_id = ?', (guild_id,))
         max_position = self.c.fetchone()[0] or 0
         next_position = max_position + 1
 
         self.c.execute('''
-            INSERT INTO queue (guild_id, url, title, duration, channel, thumbnail, position)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO queue (guild_id, url, title, duration, channel, thumbnail, position, duration_seconds)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             guild_id,
             song_info['url'],
@@ -390,14 +1733,51 @@ class QueueDB:
             song_info.get('duration', 'N/A'),
             song_info.get('channel', 'N/A'),
             song_info.get('thumbnail'),
-            next_position
+            next_position,
+            song_seconds(song_info)
         ))
         self.conn.commit()
+        self.adjust_queue_totals(guild_id, 1, song_seconds(song_info) or 0)
         return next_position
 
+    @db_timed
+    def add_many(self, guild_id: int, songs: list) -> int:
+        """남은 자리만큼만 한 번에 추가하고 추가한 곡 수를 반환 (넘치는 곡은 버림)"""
+        songs = songs[:self.get_queue_capacity(guild_id)]
+        if not songs:
+            return 0
+
+        self.c.execute('SELECT MAX(position) FROM queue WHERE guild_id = ?', (guild_id,))
+        max_position = self.c.fetchone()[0] or 0
+        self.c.execute('BEGIN')
+        try:
+            self.c.executemany('''
+                INSERT INTO queue (guild_id, url, title, duration, channel, thumbnail, position, duration_seconds)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (
+                    guild_id,
+                    song['url'],
+                    song['title'],
+                    song.get('duration', 'N/A'),
+                    song.get('channel', 'N/A'),
+                    song.get('thumbnail'),
+                    max_position + i,
+                    song_seconds(song)
+                )
+                for i, song in enumerate(songs, 1)
+            ])
+            self.c.execute('COMMIT')
+        except Exception:
+            self.c.execute('ROLLBACK')
+            raise
+        self.adjust_queue_totals(guild_id, len(songs), sum(song_seconds(song) or 0 for song in songs))
+        return len(songs)
+
+    @db_timed
     def get_queue(self, guild_id: int):
         self.c.execute('''
-            SELECT url, title, duration, channel, thumbnail, position
+            SELECT url, title, duration, channel, thumbnail, position, duration_seconds
             FROM queue
             WHERE guild_id = ?
             ORDER BY position ASC
@@ -409,14 +1789,70 @@ class QueueDB:
                 'duration': row[2],
                 'channel': row[3],
                 'thumbnail': row[4],
-                'position': row[5]
+                'position': row[5],
+                'duration_seconds': row[6]
+            }
+            for row in self.c.fetchall()
+        ]
+
+    @db_timed
+    def get_queue_page(self, guild_id: int, after_position: int = 0, limit: int = 5) -> list:
+        """position이 after_position보다 큰 곡을 limit개만 조회 (키셋 페이지네이션)"""
+        self.c.execute('''
+            SELECT url, title, duration, channel, thumbnail, position, duration_seconds
+            FROM queue
+            WHERE guild_id = ? AND position > ?
+            ORDER BY position ASC
+            LIMIT ?
+        ''', (guild_id, after_position, limit))
+        return [
+            {
+                'url': row[0],
+                'title': row[1],
+                'duration': row[2],
+                'channel': row[3],
+                'thumbnail': row[4],
+                'position': row[5],
+                'duration_seconds': row[6]
             }
             for row in self.c.fetchall()
         ]
 
+    def adjust_queue_totals(self, guild_id: int, count: int, seconds: int):
+        if guild_id in self.queue_counts:
+            self.queue_counts[guild_id] += count
+        if guild_id in self.queue_durations:
+            self.queue_durations[guild_id] += seconds
+
+    @db_timed
+    def get_queue_duration(self, guild_id: int) -> int:
+        total = self.queue_durations.get(guild_id)
+        if total is None:
+            self.c.execute('SELECT COALESCE(SUM(duration_seconds), 0) FROM queue WHERE guild_id = ?', (guild_id,))
+            total = self.queue_durations[guild_id] = self.c.fetchone()[0]
+        return total
+
+    @db_timed
+    def get_duration_before(self, guild_id: int, position: int) -> int:
+        """position 앞에 있는 곡들의 길이 합 (예상 대기 시간 계산용)"""
+        self.c.execute('''
+            SELECT COALESCE(SUM(duration_seconds), 0) FROM queue
+            WHERE guild_id = ? AND position < ?
+        ''', (guild_id, position))
+        return self.c.fetchone()[0]
+
+    @db_timed
+    def get_queue_length(self, guild_id: int) -> int:
+        count = self.queue_counts.get(guild_id)
+        if count is None:
+            self.c.execute('SELECT COUNT(*) FROM queue WHERE guild_id = ?', (guild_id,))
+            count = self.queue_counts[guild_id] = self.c.fetchone()[0]
+        return count
+
+    @db_timed
     def get_next_song(self, guild_id: int):
         self.c.execute('''
-            SELECT url, title, duration, channel, thumbnail, position
+            SELECT url, title, duration, channel, thumbnail, position, duration_seconds
             FROM queue
             WHERE guild_id = ?
             ORDER BY position ASC
@@ -430,13 +1866,24 @@ class QueueDB:
                 'duration': row[2],
                 'channel': row[3],
                 'thumbnail': row[4],
-                'position': row[5]
+                'position': row[5],
+                'duration_seconds': row[6]
             }
             self.remove_from_queue(guild_id, row[5])
             return song
         return None
 
+    @db_timed
     def remove_from_queue(self, guild_id: int, position: int):
+        if guild_id in self.queue_durations:
+            self.c.execute(
+                'SELECT duration_seconds FROM queue WHERE guild_id = ? AND position = ?',
+                (guild_id, position)
+            )
+            row = self.c.fetchone()
+            if row:
+                self.queue_durations[guild_id] -= row[0] or 0
+
         self.c.execute('''
             DELETE FROM queue
             WHERE guild_id = ? AND position = ?
@@ -450,68 +1897,194 @@ class QueueDB:
         self.conn.commit()
         
         self.c.execute('SELECT COUNT(*) FROM queue WHERE guild_id = ?', (guild_id,))
-        remaining_songs = self.c.fetchone()[0]
+        remaining_songs = self.queue_counts[guild_id] = self.c.fetchone()[0]
         return remaining_songs > 0
 
+    @db_timed
     def clear_guild_queue(self, guild_id: int):
         self.c.execute('DELETE FROM queue WHERE guild_id = ?', (guild_id,))
         self.conn.commit()
+        self.queue_counts[guild_id] = 0
+        self.queue_durations[guild_id] = 0
 
+    @db_timed
     def clear_all_queues(self):
-        self.c.execute('DELETE FROM queue')
+        if SHARD_COUNT and SHARD_IDS:
+            # 클러스터 모드에서는 이 워커가 맡은 샤드의 서버만 정리
+            placeholders = ','.join('?' * len(SHARD_IDS))
+            self.c.execute(
+                f'DELETE FROM queue WHERE (guild_id >> 22) % ? IN ({placeholders})',
+                (SHARD_COUNT, *SHARD_IDS)
+            )
+        else:
+            self.c.execute('DELETE FROM queue')
         self.conn.commit()
+        self.queue_counts.clear()
+        self.queue_durations.clear()
 
     def get_music_channel(self, guild_id: int) -> int:
-        self.c.execute('SELECT music_channel_id FROM guild_settings WHERE guild_id = ?', (guild_id,))
-        result = self.c.fetchone()
-        return result[0] if result else None
+        return self.get_guild_settings(guild_id).music_channel_id
 
+    @db_timed
     def set_music_channel(self, guild_id: int, channel_id: int):
+        # INSERT OR REPLACE는 다른 설정 컬럼을 지워버리므로 UPSERT 사용
         self.c.execute('''
-            INSERT OR REPLACE INTO guild_settings (guild_id, music_channel_id)
+            INSERT INTO guild_settings (guild_id, music_channel_id)
             VALUES (?, ?)
+            ON CONFLICT(guild_id) DO UPDATE SET music_channel_id = excluded.music_channel_id
         ''', (guild_id, channel_id))
         self.conn.commit()
+        self.get_guild_settings(guild_id).music_channel_id = channel_id
 
-    def save_queue(self, user_id: int, guild_id: int, queue_list: list, queue_name: str = None) -> dict:
-        queue_id = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        try:
-            queue_name = str(queue_name.value)
-        except AttributeError:
-            queue_name = str(queue_name) if queue_name else f"재생목록 #{queue_id}"
-
+    @db_timed
+    def set_chat_enabled(self, guild_id: int, enabled: bool):
         self.c.execute('''
-            INSERT INTO saved_queues (queue_id, user_id, guild_id, name, song_count)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (queue_id, user_id, guild_id, queue_name, len(queue_list)))
-
-        for position, song in enumerate(queue_list, 1):
-            self.c.execute('''
-                INSERT INTO saved_queue_songs 
-                (queue_id, position, url, title, duration, channel, thumbnail)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
+            INSERT INTO guild_settings (guild_id, chat_enabled)
+            VALUES (?, ?)
+            ON CONFLICT(guild_id) DO UPDATE SET chat_enabled = excluded.chat_enabled
+        ''', (guild_id, int(enabled)))
+        self.conn.commit()
+        self.get_guild_settings(guild_id).chat_enabled = int(enabled)
+
+    SAVED_QUEUE_ID_LENGTH = 6
+    SAVED_QUEUE_ID_ATTEMPTS = 10  # ID가 겹칠 때 다시 뽑는 최대 횟수
+
+    def new_queue_id(self) -> str:
+        return ''.join(random.choices(string.ascii_uppercase + string.digits, k=self.SAVED_QUEUE_ID_LENGTH))
+
+    def insert_saved_songs(self, queue_id: str, queue_list: list):
+        self.c.executemany('''
+            INSERT INTO saved_queue_songs
+            (queue_id, position, url, title, duration, channel, thumbnail, duration_seconds)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [
+            (
                 queue_id,
                 position,
                 song['url'],
                 song['title'],
                 song.get('duration'),
                 song.get('channel'),
-                song.get('thumbnail')
-            ))
+                song.get('thumbnail'),
+                song_seconds(song)
+            )
+            for position, song in enumerate(queue_list, 1)
+        ])
 
-        self.conn.commit()
+    @db_timed
+    def save_queue(self, user_id: int, guild_id: int, queue_list: list, queue_name: str = None,
+                   creator_name: str = None) -> dict:
+        try:
+            queue_name = str(queue_name.value)
+        except AttributeError:
+            queue_name = str(queue_name) if queue_name else None
+
+        # 36^6개 중에서 뽑으니 겹치는 일은 드물지만, 겹치면 기본키 충돌로 알 수 있음
+        for _ in range(self.SAVED_QUEUE_ID_ATTEMPTS):
+            queue_id = self.new_queue_id()
+            name = queue_name or f"재생목록 #{queue_id}"
+            self.c.execute('BEGIN IMMEDIATE')
+            try:
+                self.c.execute('''
+                    INSERT INTO saved_queues (queue_id, user_id, guild_id, name, song_count, creator_name)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (queue_id, user_id, guild_id, name, len(queue_list), creator_name))
+                self.insert_saved_songs(queue_id, queue_list)
+                self.c.execute('COMMIT')
+                break
+            except sqlite3.IntegrityError:
+                self.c.execute('ROLLBACK')
+            except Exception:
+                self.c.execute('ROLLBACK')
+                raise
+        else:
+            raise Exception("재생목록 ID를 만들지 못했어... 잠시 후에 다시 시도해줘!")
 
         return {
             'queue_id': queue_id,
-            'name': queue_name,
+            'name': name,
             'song_count': len(queue_list),
             'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
 
+    def export_saved_queues(self, fp) -> int:
+        """저장된 재생목록을 한 줄에 하나씩 JSONL로 내보내기"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT q.queue_id, q.user_id, q.guild_id, q.name, q.created_at, q.creator_name,
+                   s.url, s.title, s.duration, s.channel, s.thumbnail
+            FROM saved_queues q
+            LEFT JOIN saved_queue_songs s ON s.queue_id = q.queue_id
+            ORDER BY q.queue_id, s.position
+        ''')
+
+        count = 0
+        current = None
+        for row in cursor:
+            if current is None or current['queue_id'] != row[0]:
+                if current:
+                    fp.write(json.dumps(current, ensure_ascii=False) + '\n')
+                    count += 1
+                current = {
+                    'queue_id': row[0], 'user_id': row[1], 'guild_id': row[2], 'name': row[3],
+                    'created_at': row[4], 'creator_name': row[5], 'songs': []
+                }
+            if row[6] is not None:
+                current['songs'].append({
+                    'url': row[6], 'title': row[7], 'duration': row[8],
+                    'channel': row[9], 'thumbnail': row[10]
+                })
+        if current:
+            fp.write(json.dumps(current, ensure_ascii=False) + '\n')
+            count += 1
+        return count
+
+    def import_saved_queues(self, fp, batch_size: int = 1000) -> tuple:
+        """JSONL로 내보낸 재생목록 가져오기 -> (추가한 수, 이미 있어서 건너뛴 수)
+
+        처리한 재생목록 batch_size개마다 커밋함 (다른 워커가 DB를 오래 기다리지 않게)
+        중간에 실패하면 그 전 배치까지는 들어가 있으므로 SavedQueueImportError로 진행 상황을 알려줌
+        (다시 실행하면 이미 들어간 건 건너뜀)
+        """
+        imported = skipped = 0
+        committed = (0, 0)
+        batch = 0
+        line_number = 0
+        self.c.execute('BEGIN')
+        try:
+            for line_number, line in enumerate(fp, 1):
+                if not line.strip():
+                    continue
+                if batch >= batch_size:
+                    self.c.execute('COMMIT')
+                    committed = (imported, skipped)
+                    batch = 0
+                    self.c.execute('BEGIN')
+                batch += 1
+                entry = json.loads(line)
+                self.c.execute('''
+                    INSERT OR IGNORE INTO saved_queues
+                    (queue_id, user_id, guild_id, name, created_at, song_count, creator_name)
+                    VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?)
+                ''', (
+                    entry['queue_id'], entry['user_id'], entry['guild_id'], entry.get('name'),
+                    entry.get('created_at'), len(entry['songs']), entry.get('creator_name')
+                ))
+                if self.c.rowcount == 0:
+                    skipped += 1
+                    continue
+                self.insert_saved_songs(entry['queue_id'], entry['songs'])
+                imported += 1
+            self.c.execute('COMMIT')
+        except Exception as e:
+            self.c.execute('ROLLBACK')
+            raise SavedQueueImportError(*committed, line_number, e) from e
+        return imported, skipped
+
+    @db_timed
     def load_saved_queue(self, queue_id: str) -> list:
         self.c.execute('''
-            SELECT url, title, duration, channel, thumbnail, position
+            SELECT url, title, duration, channel, thumbnail, position, duration_seconds
             FROM saved_queue_songs
             WHERE queue_id = ?
             ORDER BY position ASC
@@ -524,11 +2097,51 @@ class QueueDB:
                 'duration': row[2],
                 'channel': row[3],
                 'thumbnail': row[4],
-                'position': row[5]
+                'position': row[5],
+                'duration_seconds': row[6]
             }
             for row in self.c.fetchall()
         ]
 
+    @db_timed
+    def load_saved_queue_with_info(self, queue_id: str):
+        """재생목록 정보와 곡 목록을 쿼리 한 번으로 조회 -> (info, songs)"""
+        self.c.execute('''
+            SELECT q.queue_id, q.user_id, q.name, q.created_at, q.song_count, q.creator_name,
+                   s.url, s.title, s.duration, s.channel, s.thumbnail, s.position, s.duration_seconds
+            FROM saved_queues q
+            LEFT JOIN saved_queue_songs s ON s.queue_id = q.queue_id
+            WHERE q.queue_id = ?
+            ORDER BY s.position ASC
+        ''', (queue_id,))
+
+        rows = self.c.fetchall()
+        if not rows:
+            return None, []
+        first = rows[0]
+        info = {
+            'queue_id': first[0],
+            'user_id': first[1],
+            'name': first[2],
+            'created_at': first[3],
+            'song_count': first[4],
+            'creator_name': first[5]
+        }
+        songs = [
+            {
+                'url': row[6],
+                'title': row[7],
+                'duration': row[8],
+                'channel': row[9],
+                'thumbnail': row[10],
+                'position': row[11],
+                'duration_seconds': row[12]
+            }
+            for row in rows if row[6] is not None
+        ]
+        return info, songs
+
+    @db_timed
     def get_queue_info(self, queue_id: str) -> dict:
         self.c.execute('''
             SELECT queue_id, user_id, name, created_at, song_count
@@ -547,6 +2160,7 @@ class QueueDB:
             }
         return None
 
+    @db_timed
     def shuffle_queue(self, guild_id: int):
         queue = self.get_queue(guild_id)
         if queue:
@@ -556,10 +2170,11 @@ class QueueDB:
             self.clear_guild_queue(guild_id)
             for i, song in enumerate(shuffled_queue, 1):
                 song['position'] = i
-                self.add_to_queue(guild_id, song)
+                self.add_to_queue(guild_id, song, enforce_limit=False)
             return True
         return False
 
+    @db_timed
     def sort_queue(self, guild_id: int):
         queue = self.get_queue(guild_id)
         if queue:
@@ -568,29 +2183,55 @@ class QueueDB:
             self.clear_guild_queue(guild_id)
             for i, song in enumerate(sorted_queue, 1):
                 song['position'] = i
-                self.add_to_queue(guild_id, song)
+                self.add_to_queue(guild_id, song, enforce_limit=False)
             return True
         return False
 
     def close(self):
         self.conn.close()
 
+    def load_music_players(self):
+        self.c.execute('SELECT guild_id, channel_id, message_id FROM music_players')
+        self.music_players = {
+            guild_id: (channel_id, message_id)
+            for guild_id, channel_id, message_id in self.c.fetchall()
+        }
+
+    @db_timed
     def save_music_player(self, guild_id: int, channel_id: int, message_id: int):
         self.c.execute('''
             INSERT OR REPLACE INTO music_players (guild_id, channel_id, message_id)
             VALUES (?, ?, ?)
         ''', (guild_id, channel_id, message_id))
         self.conn.commit()
+        self.music_players[guild_id] = (channel_id, message_id)
 
+    @db_timed
     def get_music_players(self) -> list:
         self.c.execute('SELECT guild_id, channel_id, message_id FROM music_players')
         return self.c.fetchall()
 
+    def get_music_player(self, guild_id: int):
+        """서버의 (channel_id, message_id), 없으면 None (DB 조회 없음)"""
+        return self.music_players.get(guild_id)
+
+    @db_timed
     def remove_music_player(self, guild_id: int):
         self.c.execute('DELETE FROM music_players WHERE guild_id = ?', (guild_id,))
         self.conn.commit()
+        self.music_players.pop(guild_id, None)
 
     def get_guild_settings(self, guild_id: int) -> GuildSettings:
+        settings = self.settings_cache.get(guild_id)
+        if settings is None:
+            CACHE_REQUESTS.inc(cache='guild_settings', result='miss')
+            settings = self.settings_cache[guild_id] = self.load_guild_settings(guild_id)
+        else:
+            CACHE_REQUESTS.inc(cache='guild_settings', result='hit')
+        return settings
+
+    @db_timed
+    def load_guild_settings(self, guild_id: int) -> GuildSettings:
         self.c.execute('''
             SELECT * FROM guild_settings WHERE guild_id = ?
         ''', (guild_id,))
@@ -599,8 +2240,62 @@ class QueueDB:
             return GuildSettings.from_db(dict(row))
         return GuildSettings(guild_id)
 
+    @db_timed
+    def get_track_loudness(self, track_id: str):
+        self.c.execute('SELECT integrated_lufs FROM track_loudness WHERE track_id = ?', (track_id,))
+        row = self.c.fetchone()
+        return row[0] if row else None
+
+    @db_timed
+    def save_track_loudness(self, track_id: str, integrated_lufs: float):
+        self.c.execute('''
+            INSERT OR REPLACE INTO track_loudness (track_id, integrated_lufs)
+            VALUES (?, ?)
+        ''', (track_id, integrated_lufs))
+        self.conn.commit()
+
 db = QueueDB()
 
+SAVED_QUEUE_CACHE_SIZE = 1000  # 메모리에 들고 있는 저장된 재생목록 수
+
+class SavedQueueService:
+    """저장된 재생목록 조회 (프로세스 LRU -> 클러스터 공유 캐시 -> DB 순서)
+
+    저장된 재생목록은 만든 뒤에 바뀌지 않아서 오래 캐시해도 됨
+    """
+    def __init__(self):
+        self.cache = cachetools.LRUCache(maxsize=SAVED_QUEUE_CACHE_SIZE)
+
+    async def load(self, queue_id: str):
+        cached = self.cache.get(queue_id)
+        if cached:
+            CACHE_REQUESTS.inc(cache='saved_queue', result='hit')
+            return cached
+        CACHE_REQUESTS.inc(cache='saved_queue', result='miss')
+
+        if cluster:
+            shared = await cluster.cache_get('saved_queue', queue_id)
+            if shared:
+                entry = self.cache[queue_id] = (shared['info'], shared['songs'])
+                return entry
+
+        queue_info, songs = db.load_saved_queue_with_info(queue_id)
+        if not songs:
+            return None, []
+        entry = self.cache[queue_id] = (queue_info, songs)
+        if cluster:
+            await cluster.cache_set('saved_queue', queue_id, {'info': queue_info, 'songs': songs})
+        return entry
+
+    def creator_name(self, queue_info: dict) -> str:
+        """생성자 이름 (저장된 이름 -> 유저 캐시 -> 멘션, API 호출 없음)"""
+        if queue_info.get('creator_name'):
+            return queue_info['creator_name']
+        user = bot.get_user(queue_info['user_id'])
+        return str(user) if user else f"<@{queue_info['user_id']}>"
+
+saved_queues = SavedQueueService()
+
 class SaveQueueModal(Modal):
     def __init__(self, queue_list):
         super().__init__(title='재생목록 저장')
@@ -623,7 +2318,8 @@ class SaveQueueModal(Modal):
             user_id=interaction.user.id,
             guild_id=interaction.guild_id,
             queue_list=self.queue_list,
-            queue_name=self.queue_name.value if self.queue_name.value else None
+            queue_name=self.queue_name.value if self.queue_name.value else None,
+            creator_name=str(interaction.user)
         )
 
         try:
@@ -707,19 +2403,15 @@ class PlayingView(View):
 
     @nextcord.ui.button(label="노래 검색", style=nextcord.ButtonStyle.primary, row=0)
     async def search_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
-        search_lock = get_search_lock(interaction.guild_id)
-        if search_lock.is_locked:
-            if search_lock.current_user != interaction.user:
-                await interaction.response.send_message(
-                    f"❌ {search_lock.current_user.name}의 검색이 진행 중이야..! 잠시만 기다려줘!", 
-                    ephemeral=True
-                )
-                return
-        
-        search_lock.is_locked = True
-        search_lock.current_user = interaction.user
-        
-        modal = SearchModal(interaction.message, self)
+        search = search_sessions.begin(interaction.guild_id, interaction.user.id, SEARCH_MODAL_TIMEOUT)
+        if not search:
+            await interaction.response.send_message(
+                "❌ 지금 검색 중인 사람이 너무 많아..! 잠시만 기다려줘!",
+                ephemeral=True
+            )
+            return
+
+        modal = SearchModal(interaction.message, self, search)
         await interaction.response.send_modal(modal)
 
     @nextcord.ui.button(label="⏭️ 스킵", style=nextcord.ButtonStyle.secondary, row=0)
@@ -731,32 +2423,21 @@ class PlayingView(View):
                 await interaction.response.send_message("⏭️ 다음 곡으로 넘어갈게!", ephemeral=True)
             else:
                 await interaction.response.send_message("⏭️ 이게 마지막 곡이야!", ephemeral=True)
-            voice_client.stop()
-        else:
-            await interaction.response.send_message("❌ 현재 재생 중인 노래가 없어..!", ephemeral=True)
-
-    @nextcord.ui.button(label="재생목록 보기", style=nextcord.ButtonStyle.secondary, row=0)
-    async def queue_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
-        queue = db.get_queue(interaction.guild_id)
-        if not queue:
-            await interaction.response.send_message("재생목록에 아무것도 없는 것 같은데?", ephemeral=True)
-            return
-
-        queue_embed = nextcord.Embed(
-            title="🎵 재생목록",
-            description=f"페이지 1/{((len(queue) - 1) // 5) + 1}",
-            color=nextcord.Color.blue()
-       )
-
-        for song in queue[:5]:
-            queue_embed.add_field(
-                name=f"{song['position']}. {song['title']}",
-                value=f"길이: {song['duration']} | 채널: {song['channel']}",
-                inline=False
+            # 복구/곡 전환이 진행 중이어도 바로 멈추도록 명령보다 먼저 표시
+            mark_stop_requested(interaction.guild_id)
+            get_player(interaction.guild_id, interaction.message).post(
+                'skip', song=get_current_playing_song(interaction.guild_id)
             )
+        else:
+            await interaction.response.send_message("❌ 현재 재생 중인 노래가 없어..!", ephemeral=True)
 
-        queue_view = QueueView(queue)
-        queue_view.update_buttons()
+    @nextcord.ui.button(label="재생목록 보기", style=nextcord.ButtonStyle.secondary, row=0)
+    async def queue_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
+        queue_view = QueueView(interaction.guild_id)
+        queue_embed = queue_view.build_page()
+        if not queue_embed:
+            await interaction.response.send_message("재생목록에 아무것도 없는 것 같은데?", ephemeral=True)
+            return
 
         await interaction.response.send_message(
             embed=queue_embed,
@@ -766,15 +2447,14 @@ class PlayingView(View):
 
     @nextcord.ui.button(label="🔁 반복", style=nextcord.ButtonStyle.secondary, row=1)
     async def repeat_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
-        guild_id = interaction.guild_id
-        current_state = get_repeat_state(guild_id)
-        repeat_states[guild_id] = not current_state
+        session = get_session(interaction.guild_id)
+        session.repeat = not session.repeat
         
-        button.style = nextcord.ButtonStyle.success if repeat_states[guild_id] else nextcord.ButtonStyle.secondary
+        button.style = nextcord.ButtonStyle.success if session.repeat else nextcord.ButtonStyle.secondary
         
         await interaction.response.edit_message(view=self)
         await interaction.followup.send(
-            f"🔁 반복 재생을 {'켰어!' if repeat_states[guild_id] else '껐어!'}", 
+            f"🔁 반복 재생을 {'켰어!' if session.repeat else '껐어!'}", 
             ephemeral=True
         )
 
@@ -787,11 +2467,11 @@ class PlayingView(View):
             await interaction.response.send_message("❌ 재생목록이 비어있어..!", ephemeral=True)
             return
         
-        current_state = get_shuffle_state(guild_id)
-        shuffle_states[guild_id] = not current_state
-        button.style = nextcord.ButtonStyle.success if shuffle_states[guild_id] else nextcord.ButtonStyle.secondary
+        session = get_session(guild_id)
+        session.shuffle = not session.shuffle
+        button.style = nextcord.ButtonStyle.success if session.shuffle else nextcord.ButtonStyle.secondary
         
-        if shuffle_states[guild_id]:
+        if session.shuffle:
             db.shuffle_queue(guild_id)
             await interaction.response.send_message("🔀 재생목록을 마구마구 섞어버렸어!", ephemeral=True)
         else:
@@ -807,11 +2487,9 @@ class PlayingView(View):
             # 먼저 응답 defer
             await interaction.response.defer(ephemeral=True)
             
-            await voice_client.disconnect()
-            current_playing.pop(interaction.guild_id, None)
-            db.clear_guild_queue(interaction.guild_id)
-            repeat_states[interaction.guild_id] = False
-            shuffle_states[interaction.guild_id] = False
+            # 복구가 다시 연결하는 중이어도 바로 멈추도록 명령보다 먼저 표시
+            mark_stop_requested(interaction.guild_id)
+            await get_player(interaction.guild_id, interaction.message).request('stop', voice_client=voice_client)
             
             initial_embed = nextcord.Embed(
                 title="🎵 노래 부르는 미루",
@@ -827,13 +2505,39 @@ class PlayingView(View):
         else:
             await interaction.response.send_message("❌ 미루 이미 음성 채널에 없어.", ephemeral=True)
 
+    @nextcord.ui.button(label="⏪ 10초", style=nextcord.ButtonStyle.secondary, row=2)
+    async def rewind_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
+        await seek_and_respond(interaction, get_playback_position(interaction.guild_id) - 10)
+
+    @nextcord.ui.button(label="⏩ 10초", style=nextcord.ButtonStyle.secondary, row=2)
+    async def forward_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
+        await seek_and_respond(interaction, get_playback_position(interaction.guild_id) + 10)
+
+async def seek_and_respond(interaction: nextcord.Interaction, position: float):
+    """재생 위치 이동 후 결과를 알려주는 함수 (버튼/슬래시 명령어 공용)"""
+    await interaction.response.defer(ephemeral=True)
+    try:
+        position = await get_player(interaction.guild_id).request(
+            'seek', voice_client=interaction.guild.voice_client, position=position
+        )
+    except Exception as e:
+        await interaction.followup.send(str(e), ephemeral=True)
+        return
+    await interaction.followup.send(f"⏩ {format_duration(position)}로 이동했어!", ephemeral=True)
+
 class QueueView(View):
-    def __init__(self, queue_list, current_page=0):
+    """보이는 페이지의 곡만 DB에서 가져오는 재생목록 보기"""
+    def __init__(self, guild_id: int):
         super().__init__(timeout=60)
-        self.queue_list = queue_list
-        self.current_page = current_page
+        self.guild_id = guild_id
         self.items_per_page = 5
-        self.max_pages = ((len(queue_list) - 1) // self.items_per_page) + 1
+        self.page_starts = [0]  # 각 페이지 직전 곡의 position (이전 페이지로 돌아갈 때 사용)
+        self.last_position = 0
+        self.max_pages = 1
+
+    @property
+    def current_page(self):
+        return len(self.page_starts) - 1
 
     async def interaction_check(self, interaction: nextcord.Interaction) -> bool:
         if not interaction.guild.voice_client:
@@ -858,19 +2562,20 @@ class QueueView(View):
 
     @nextcord.ui.button(label="◀", style=nextcord.ButtonStyle.secondary, disabled=True, custom_id="prev")
     async def prev_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
-        self.current_page -= 1
+        if len(self.page_starts) > 1:
+            self.page_starts.pop()
         await self.update_page(interaction)
 
     @nextcord.ui.button(label="▶", style=nextcord.ButtonStyle.secondary, custom_id="next")
     async def next_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
-        self.current_page += 1
+        self.page_starts.append(self.last_position)
         await self.update_page(interaction)
 
     @nextcord.ui.button(label="재생목록 저장", style=nextcord.ButtonStyle.success, custom_id="save")
     async def save_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
         current_song = get_current_playing_song(interaction.guild_id)
         full_queue = [current_song] if current_song else []
-        full_queue.extend(self.queue_list)
+        full_queue.extend(db.get_queue(interaction.guild_id))
 
         modal = SaveQueueModal(full_queue)
         await interaction.response.send_modal(modal)
@@ -883,34 +2588,62 @@ class QueueView(View):
                 elif child.custom_id == "next":
                     child.disabled = (self.current_page >= self.max_pages - 1)
 
-    async def update_page(self, interaction: nextcord.Interaction):
-        self.update_buttons()
+    def build_page(self):
+        """현재 페이지 임베드 생성, 재생목록이 비어 있으면 None"""
+        current_items = db.get_queue_page(self.guild_id, self.page_starts[-1], self.items_per_page)
+        if not current_items and len(self.page_starts) > 1:
+            # 그사이 곡이 재생돼서 페이지가 줄어든 경우 처음으로
+            self.page_starts = [0]
+            current_items = db.get_queue_page(self.guild_id, 0, self.items_per_page)
+        if not current_items:
+            return None
 
-        start_idx = self.current_page * self.items_per_page
-        end_idx = start_idx + self.items_per_page
-        current_items = self.queue_list[start_idx:end_idx]
+        self.last_position = current_items[-1]['position']
+        total = db.get_queue_length(self.guild_id)
+        self.max_pages = max(((total - 1) // self.items_per_page) + 1, self.current_page + 1)
+        self.update_buttons()
 
         queue_embed = nextcord.Embed(
             title="🎵 재생목록",
-            description=f"페이지 {self.current_page + 1}/{self.max_pages}",
+            description=f"페이지 {self.current_page + 1}/{self.max_pages}\n"
+                        f"총 {total}곡 | {format_duration(db.get_queue_duration(self.guild_id))}",
             color=nextcord.Color.blue()
         )
 
+        # 예상 대기 시간 = 현재 곡의 남은 시간 + 이 페이지 앞에 있는 곡들의 길이
+        wait = db.get_duration_before(self.guild_id, current_items[0]['position'])
+        current_song = get_current_playing_song(self.guild_id)
+        if current_song and song_seconds(current_song):
+            wait += max(0, song_seconds(current_song) - get_playback_position(self.guild_id))
+
         for song in current_items:
             queue_embed.add_field(
                 name=f"{song['position']}. {song['title']}",
-                value=f"길이: {song['duration']} | 채널: {song['channel']}",
+                value=f"길이: {song['duration']} | 채널: {song['channel']} | ⏳ 약 {format_duration(wait)} 후",
                 inline=False
             )
+            wait += song_seconds(song) or 0
+        return queue_embed
 
+    async def update_page(self, interaction: nextcord.Interaction):
+        queue_embed = self.build_page()
+        if not queue_embed:
+            await interaction.response.edit_message(content="재생목록에 아무것도 없는 것 같은데?", embed=None, view=None)
+            return
         await interaction.response.edit_message(embed=queue_embed, view=self)
 
 
+PLAYLIST_MAX_TRACKS = 100  # 플레이리스트 하나에서 불러오는 최대 곡 수
+
+def skipped_note(skipped: int) -> str:
+    return f"\n(재생목록 한도 때문에 {skipped}곡은 빼놨어!)" if skipped > 0 else ""
+
 class SearchModal(Modal):
-    def __init__(self, original_message, view):
-        super().__init__(title="노래 검색")
+    def __init__(self, original_message, view, search: SearchSession):
+        super().__init__(title="노래 검색", timeout=SEARCH_MODAL_TIMEOUT)
         self.original_message = original_message
         self.view = view
+        self.search = search
         
         self.query = TextInput(
             label="검색어를 입력해줘!", 
@@ -921,42 +2654,40 @@ class SearchModal(Modal):
         )
         self.add_item(self.query)
 
+    async def on_timeout(self):
+        search_sessions.end(self.search)
+
     async def callback(self, interaction: nextcord.Interaction):
+        requested_at = time.perf_counter()
         await interaction.response.defer()
         query = str(self.query.value)
+
+        if not search_sessions.is_active(self.search):
+            await interaction.followup.send("❌ 검색 시간이 지났어... 다시 검색해줘!", ephemeral=True)
+            return
         
         # 취소 명령어 체크
         if query.lower() in ['cancel', '취소']:
-            current_song = get_current_playing_song(interaction.guild_id)
-            if current_song and interaction.guild.voice_client and interaction.guild.voice_client.is_playing():
-                playing_embed = create_playing_embed(current_song)
-                await self.original_message.edit(embed=playing_embed, view=PlayingView(self.original_message, current_song))
-            else:
-                initial_embed = nextcord.Embed(
-                    title="🎵 노래 부르는 미루",
-                    description="아래 버튼을 눌러서 미루에게 음악을 검색해봐!",
-                    color=nextcord.Color.blue()
-                )
-                await self.original_message.edit(embed=initial_embed, view=InitialView(self.original_message))
-            
-            search_lock = get_search_lock(interaction.guild_id)
-            search_lock.is_locked = False
-            search_lock.current_user = None
-            
+            search_sessions.end(self.search)
             await interaction.followup.send("❌ 검색을 취소했어...", ephemeral=True)
             return
 
+        handed_off = False  # 검색 결과 선택 화면으로 세션을 넘겼는지
         try:
+            # 저장된 재생목록 ID와 유튜브 링크는 바로 재생목록에 들어가므로 여기서 차감 (검색어는 곡을 고를 때)
+            if re.match(r'^[A-Z0-9]{6}$', query) or "youtube.com/" in query or "youtu.be/" in query:
+                enqueue_limiter.charge(interaction.user.id)
+
             # 재생목록 ID 체크 (6자리 영문/숫자)
             if re.match(r'^[A-Z0-9]{6}$', query):
-                saved_queue = db.load_saved_queue(query)
+                queue_info, saved_queue = await saved_queues.load(query)
                 if not saved_queue:
-                    await self.original_message.edit(
-                        embed=nextcord.Embed(title="❌ 오류", description="엥..? 이건 미루가 모르는 재생목록 ID인데..?", color=nextcord.Color.red())
+                    await interaction.followup.send(
+                        embed=nextcord.Embed(title="❌ 오류", description="엥..? 이건 미루가 모르는 재생목록 ID인데..?", color=nextcord.Color.red()),
+                        ephemeral=True
                     )
                     return
 
-                queue_info = db.get_queue_info(query)
                 loading_embed = nextcord.Embed(
                     title="📋 저장된 재생목록을 불러오는 중...",
                     description=f"'{queue_info['name']}' 재생목록을 불러오고 있어!",
@@ -965,7 +2696,7 @@ class SearchModal(Modal):
                 loading_embed.add_field(
                     name="재생목록 정보",
                     value=f"총 {queue_info['song_count']}곡\n"
-                          f"생성자: {await bot.fetch_user(queue_info['user_id'])}\n"
+                          f"생성자: {saved_queues.creator_name(queue_info)}\n"
                           f"생성일: {queue_info['created_at']}"
                 )
                 await self.original_message.edit(embed=loading_embed)
@@ -975,12 +2706,32 @@ class SearchModal(Modal):
                     voice_client = await interaction.user.voice.channel.connect()
 
                 if voice_client.is_playing():
-                    for song in saved_queue:
-                        db.add_to_queue(interaction.guild_id, song)
-                    
+                    started = False
+                    added = db.add_many(interaction.guild_id, saved_queue)
+                    if not added:
+                        raise QueueFullError(db.get_guild_settings(interaction.guild_id).max_queue_size)
+                    skipped = len(saved_queue) - added
+                else:
+                    first_song = dict(saved_queue[0])  # 캐시된 곡 정보는 건드리지 않음
+                    remaining_songs = saved_queue[1:]
+
+                    started, _ = await get_player(interaction.guild_id, self.original_message).request(
+                        'play', voice_client=voice_client, song_info=first_song, requested_at=requested_at
+                    )
+
+                    added = db.add_many(interaction.guild_id, remaining_songs)
+                    skipped = len(remaining_songs) - added
+                    if not started:
+                        added += 1  # 다른 검색이 먼저 재생을 시작해서 첫 곡도 재생목록에 들어감
+
+                if started:
+                    playing_embed = create_playing_embed(first_song, interaction.guild_id)
+                    playing_embed.description = f"저장된 재생목록의 나머지 {added}곡을 재생목록에 추가했어!" + skipped_note(skipped)
+                    await self.original_message.edit(embed=playing_embed, view=PlayingView(self.original_message))
+                else:
                     success_embed = nextcord.Embed(
                         title="📋 저장된 재생목록 추가",
-                        description=f"총 {len(saved_queue)}곡을 재생목록에 추가했어!",
+                        description=f"총 {added}곡을 재생목록에 추가했어!" + skipped_note(skipped),
                         color=nextcord.Color.green()
                     )
                     view = PlayingView(self.original_message, get_current_playing_song(interaction.guild_id))
@@ -990,29 +2741,8 @@ class SearchModal(Modal):
                     await asyncio.sleep(3)
                     current_song = get_current_playing_song(interaction.guild_id)
                     if current_song:
-                        playing_embed = create_playing_embed(current_song)
+                        playing_embed = create_playing_embed(current_song, interaction.guild_id)
                         await self.original_message.edit(embed=playing_embed, view=view)
-                else:
-                    first_song = saved_queue[0]
-                    remaining_songs = saved_queue[1:]
-
-                    source = await get_audio_source(first_song['url'], interaction.guild_id)
-                    
-                    def after_playing(error):
-                        asyncio.run_coroutine_threadsafe(
-                            play_next(interaction.guild_id, self.original_message),
-                            bot.loop
-                        )
-
-                    voice_client.play(source, after=after_playing)
-                    set_current_playing_song(interaction.guild_id, first_song)
-
-                    for song in remaining_songs:
-                        db.add_to_queue(interaction.guild_id, song)
-
-                    playing_embed = create_playing_embed(first_song)
-                    playing_embed.description = f"저장된 재생목록의 나머지 {len(remaining_songs)}곡을 재생목록에 추가했어!"
-                    await self.original_message.edit(embed=playing_embed, view=PlayingView(self.original_message))
                 return
 
             # YouTube 링크 체크
@@ -1026,13 +2756,16 @@ class SearchModal(Modal):
                     )
                     await self.original_message.edit(embed=loading_embed)
 
-                    loop = asyncio.get_event_loop()
-                    playlist_data = await loop.run_in_executor(None, lambda: ytdl.extract_info(query, download=False))
+                    playlist_data = await extract_info(query, 'playlist', interaction.guild_id)
 
                     if not playlist_data:
                         raise Exception("플레이리스트를 불러올 수 없어...")
 
-                    total_tracks = len(playlist_data['entries'])
+                    # 큰 플레이리스트는 앞에서부터 PLAYLIST_MAX_TRACKS곡만
+                    entries = list(playlist_data['entries'] or [])
+                    capped_tracks = max(0, len(entries) - PLAYLIST_MAX_TRACKS)
+                    entries = entries[:PLAYLIST_MAX_TRACKS]
+                    total_tracks = len(entries)
                     loaded_tracks = 0
 
                     loading_embed = nextcord.Embed(
@@ -1046,13 +2779,14 @@ class SearchModal(Modal):
                     first_track = None
                     playlist_tracks = []
 
-                    for entry in playlist_data['entries']:
+                    for entry in entries:
                         if entry:
                             loaded_tracks += 1
                             song_info = {
                                 'url': entry['url'],
                                 'title': entry['title'],
                                 'duration': entry.get('duration_string', 'N/A'),
+                                'duration_seconds': parse_duration(entry.get('duration')),
                                 'channel': entry.get('uploader', 'N/A'),
                                 'thumbnail': entry.get('thumbnail')
                             }
@@ -1077,13 +2811,32 @@ class SearchModal(Modal):
                         voice_client = await interaction.user.voice.channel.connect()
 
                     if voice_client.is_playing():
+                        started = False
                         all_tracks = [first_track] + playlist_tracks
-                        for track in all_tracks:
-                            db.add_to_queue(interaction.guild_id, track)
-                        
+                        added = db.add_many(interaction.guild_id, all_tracks)
+                        if not added:
+                            raise QueueFullError(db.get_guild_settings(interaction.guild_id).max_queue_size)
+                        skipped = len(all_tracks) - added + capped_tracks
+                    else:
+                        started, _ = await get_player(interaction.guild_id, self.original_message).request(
+                            'play', voice_client=voice_client, song_info=first_track, requested_at=requested_at
+                        )
+
+                        added = db.add_many(interaction.guild_id, playlist_tracks)
+                        skipped = len(playlist_tracks) - added + capped_tracks
+                        if not started:
+                            added += 1  # 다른 검색이 먼저 재생을 시작해서 첫 곡도 재생목록에 들어감
+
+                    if started:
+                        playing_embed = create_playing_embed(first_track, interaction.guild_id)
+                        playing_embed.description = (
+                            f"플레이리스트의 나머지 {added}곡을 재생목록에 추가했어!" + skipped_note(skipped)
+                        )
+                        await self.original_message.edit(embed=playing_embed, view=PlayingView(self.original_message))
+                    else:
                         success_embed = nextcord.Embed(
                             title="📋 플레이리스트 재생목록에 추가",
-                            description=f"총 {total_tracks}곡을 재생목록에 추가했어!",
+                            description=f"총 {added}곡을 재생목록에 추가했어!" + skipped_note(skipped),
                             color=nextcord.Color.green()
                         )
                         view = PlayingView(self.original_message, get_current_playing_song(interaction.guild_id))
@@ -1093,26 +2846,8 @@ class SearchModal(Modal):
                         await asyncio.sleep(3)
                         current_song = get_current_playing_song(interaction.guild_id)
                         if current_song:
-                            playing_embed = create_playing_embed(current_song)
+                            playing_embed = create_playing_embed(current_song, interaction.guild_id)
                             await self.original_message.edit(embed=playing_embed, view=view)
-                    else:
-                        source = await get_audio_source(first_track['url'], interaction.guild_id)
-                        
-                        def after_playing(error):
-                            asyncio.run_coroutine_threadsafe(
-                                play_next(interaction.guild_id, self.original_message),
-                                bot.loop
-                            )
-
-                        voice_client.play(source, after=after_playing)
-                        set_current_playing_song(interaction.guild_id, first_track)
-
-                        for track in playlist_tracks:
-                            db.add_to_queue(interaction.guild_id, track)
-
-                        playing_embed = create_playing_embed(first_track)
-                        playing_embed.description = f"플레이리스트의 나머지 {len(playlist_tracks)}곡을 재생목록에 추가했어!"
-                        await self.original_message.edit(embed=playing_embed, view=PlayingView(self.original_message))
 
                 else:  # 단일 영상 링크
                     loading_embed = nextcord.Embed(
@@ -1128,17 +2863,17 @@ class SearchModal(Modal):
                         voice_client = await interaction.user.voice.channel.connect()
 
                     if voice_client.is_playing():
-                        position = db.add_to_queue(interaction.guild_id, song_info)
-                        
-                        queue_embed = nextcord.Embed(
-                            title="🎵 재생목록에 추가",
-                            color=nextcord.Color.blue()
+                        started, position = False, db.add_to_queue(interaction.guild_id, song_info)
+                    else:
+                        started, position = await get_player(interaction.guild_id, self.original_message).request(
+                            'play', voice_client=voice_client, song_info=song_info, requested_at=requested_at
                         )
-                        queue_embed.add_field(name="제목", value=song_info['title'], inline=False)
-                        queue_embed.add_field(name="재생목록 위치", value=f"{position}번째", inline=True)
-                        if song_info['thumbnail']:
-                            queue_embed.set_thumbnail(url=song_info['thumbnail'])
-                        
+
+                    if started:
+                        playing_embed = create_playing_embed(song_info, interaction.guild_id)
+                        await self.original_message.edit(embed=playing_embed, view=PlayingView(self.original_message))
+                    else:
+                        queue_embed = create_queued_embed(song_info, position)
                         view = PlayingView(self.original_message, get_current_playing_song(interaction.guild_id))
                         await self.original_message.edit(embed=queue_embed, view=view)
                         
@@ -1146,28 +2881,15 @@ class SearchModal(Modal):
                         await asyncio.sleep(3)
                         current_song = get_current_playing_song(interaction.guild_id)
                         if current_song:
-                            playing_embed = create_playing_embed(current_song)
+                            playing_embed = create_playing_embed(current_song, interaction.guild_id)
                             await self.original_message.edit(embed=playing_embed, view=view)
-                    else:
-                        source = await get_audio_source(song_info['url'], interaction.guild_id)
-                        
-                        def after_playing(error):
-                            asyncio.run_coroutine_threadsafe(
-                                play_next(interaction.guild_id, self.original_message),
-                                bot.loop
-                            )
-
-                        voice_client.play(source, after=after_playing)
-                        set_current_playing_song(interaction.guild_id, song_info)
-
-                        playing_embed = create_playing_embed(song_info)
-                        await self.original_message.edit(embed=playing_embed, view=PlayingView(self.original_message))
 
             else:  # 일반 검색어
                 results = YoutubeSearch(query, max_results=5).to_dict()
                 if not results:
-                    await self.original_message.edit(
-                        embed=nextcord.Embed(title="❌ 검색 실패", description="미루... 못 찾겠어... 🥺", color=nextcord.Color.red())
+                    await interaction.followup.send(
+                        embed=nextcord.Embed(title="❌ 검색 실패", description="미루... 못 찾겠어... 🥺", color=nextcord.Color.red()),
+                        ephemeral=True
                     )
                     return
 
@@ -1183,8 +2905,11 @@ class SearchModal(Modal):
                         inline=False
                     )
 
-                select_view = SongSelectView(results, interaction, self.original_message)
-                await self.original_message.edit(embed=results_embed, view=select_view)
+                # 결과는 검색한 사람에게만 보여줘서 여러 명이 동시에 검색해도 플레이어가 덮이지 않음
+                select_view = SongSelectView(results, interaction, self.original_message, self.search)
+                search_sessions.extend(self.search, select_view.timeout)
+                handed_off = True
+                await interaction.followup.send(embed=results_embed, view=select_view, ephemeral=True)
 
         except Exception as e:
             error_embed = nextcord.Embed(
@@ -1192,18 +2917,24 @@ class SearchModal(Modal):
                 description=str(e),
                 color=nextcord.Color.red()
             )
-            await self.original_message.edit(embed=error_embed)
+            # 오류는 검색한 사람에게만 보여주고, 불러오는 중 화면을 띄워뒀으면 플레이어를 원래대로 돌려놓음
+            await interaction.followup.send(embed=error_embed, ephemeral=True)
+            try:
+                await restore_player_message(interaction.guild_id, self.original_message)
+            except nextcord.HTTPException as restore_error:
+                print(f"Failed to restore player message: {restore_error}")
         finally:
-            search_lock = get_search_lock(interaction.guild_id)
-            search_lock.is_locked = False
-            search_lock.current_user = None
+            if not handed_off:
+                search_sessions.end(self.search)
 
 class SongSelectView(View):
-    def __init__(self, results, original_interaction, message):
+    """검색한 유저에게만 보이는 검색 결과 선택 화면 (선택하면 플레이어 메시지에 반영)"""
+    def __init__(self, results, original_interaction, message, search: SearchSession):
         super().__init__(timeout=60)
         self.results = results
         self.original_interaction = original_interaction
-        self.message = message
+        self.message = message  # 서버의 플레이어 메시지
+        self.search = search
 
         # 숫자 버튼 추가
         for i in range(len(results)):
@@ -1227,33 +2958,13 @@ class SongSelectView(View):
             child.callback = self.create_button_callback(i)
         self.children[-1].callback = self.cancel_callback  # 취소 버튼
 
-    async def cancel_callback(self, interaction: nextcord.Interaction):
-        if interaction.user != self.original_interaction.user:
-            await interaction.response.send_message(
-                "❌ 검색한 유저만 취소할 수 있어..!", 
-                ephemeral=True
-            )
-            return
-
-        # 현재 재생중인 노래가 있다면 그 정보를 표시
-        current_song = get_current_playing_song(interaction.guild_id)
-        if current_song and interaction.guild.voice_client and interaction.guild.voice_client.is_playing():
-            playing_embed = create_playing_embed(current_song)
-            await interaction.message.edit(embed=playing_embed, view=PlayingView(interaction.message, current_song))
-        else:
-            initial_embed = nextcord.Embed(
-                title="🎵 노래 부르는 미루",
-                description="아래 버튼을 눌러서 미루에게 음악을 검색해봐!",
-                color=nextcord.Color.blue()
-            )
-            await interaction.message.edit(embed=initial_embed, view=InitialView(interaction.message))
-
-        # 검색 잠금 해제
-        search_lock = get_search_lock(interaction.guild_id)
-        search_lock.is_locked = False
-        search_lock.current_user = None
+    async def on_timeout(self):
+        search_sessions.end(self.search)
 
-        await interaction.response.send_message("❌ 검색을 취소했어...", ephemeral=True)
+    async def cancel_callback(self, interaction: nextcord.Interaction):
+        search_sessions.end(self.search)
+        self.stop()
+        await interaction.response.edit_message(content="❌ 검색을 취소했어...", embed=None, view=None)
 
     async def interaction_check(self, interaction: nextcord.Interaction) -> bool:
         if interaction.user != self.original_interaction.user:
@@ -1263,6 +2974,10 @@ class SongSelectView(View):
             )
             return False
 
+        if not search_sessions.is_active(self.search):
+            await interaction.response.edit_message(content="❌ 검색 시간이 지났어... 다시 검색해줘!", embed=None, view=None)
+            return False
+
         if not interaction.user.voice:
             await interaction.response.send_message(
                 "❌ 음성 채널에 먼저 들어가줘..!", 
@@ -1282,66 +2997,52 @@ class SongSelectView(View):
 
     def create_button_callback(self, index):
         async def button_callback(interaction: nextcord.Interaction):
-            try:
-                # 먼저 응답 지연 처리
-                await interaction.response.defer()
+            requested_at = time.perf_counter()
+            # 제한에 걸려도 검색 결과는 그대로 두고 조금 뒤에 다시 고를 수 있게 함
+            if not enqueue_limiter.allow(interaction.user.id):
+                await interaction.response.send_message("❌ 너무 빨라..! 조금만 천천히 추가해줘!", ephemeral=True)
+                return
 
+            # 선택은 한 번만 (두 번 눌러도 한 곡만 추가)
+            search_sessions.end(self.search)
+            self.stop()
+            try:
                 selected_video = self.results[index]
                 video_url = f"https://youtube.com{selected_video['url_suffix']}"
 
+                loading_embed = nextcord.Embed(
+                    title="🎵 재생 준비 중...",
+                    description=selected_video['title'],
+                    color=nextcord.Color.yellow()
+                )
+                await interaction.response.edit_message(embed=loading_embed, view=None)
+
                 try:
                     voice_client = interaction.guild.voice_client
                     if not voice_client:
                         voice_client = await interaction.user.voice.channel.connect()
 
-                    loading_embed = nextcord.Embed(
-                        title="🎵 재생 준비 중...",
-                        description=selected_video['title'],
-                        color=nextcord.Color.yellow()
-                    )
-                    await interaction.message.edit(embed=loading_embed, view=None)
-
                     song_info = await get_song_info(video_url, interaction.guild_id)
 
                     if voice_client.is_playing():
-                        position = db.add_to_queue(interaction.guild_id, song_info)
-
-                        queue_embed = nextcord.Embed(
-                            title="🎵 재생목록에 추가",
-                            color=nextcord.Color.blue()
+                        started, position = False, db.add_to_queue(interaction.guild_id, song_info)
+                    else:
+                        started, position = await get_player(interaction.guild_id, self.message).request(
+                            'play', voice_client=voice_client, song_info=song_info, requested_at=requested_at
                         )
-                        queue_embed.add_field(name="제목", value=song_info['title'], inline=False)
-                        queue_embed.add_field(name="재생목록 위치", value=f"{position}번째", inline=True)
-                        if song_info['thumbnail']:
-                            queue_embed.set_thumbnail(url=song_info['thumbnail'])
 
-                        view = PlayingView(interaction.message, get_current_playing_song(interaction.guild_id))
-                        await interaction.message.edit(embed=queue_embed, view=view)
+                    if started:
+                        playing_embed = create_playing_embed(song_info, interaction.guild_id)
+                        view = PlayingView(self.message, song_info)
+                        await self.message.edit(embed=playing_embed, view=view)
+                        await interaction.delete_original_message()
+                    else:
+                        await interaction.edit_original_message(embed=create_queued_embed(song_info, position))
 
-                        await asyncio.sleep(3)
                         current_song = get_current_playing_song(interaction.guild_id)
                         if current_song:
-                            playing_embed = create_playing_embed(current_song)
-                            await interaction.message.edit(embed=playing_embed, view=view)
-                    else:
-                        source = await get_audio_source(song_info['url'], interaction.guild_id)
-
-                        def after_playing(error):
-                            asyncio.run_coroutine_threadsafe(
-                                play_next(interaction.guild_id, interaction.message),
-                                bot.loop
-                            )
-
-                        voice_client.play(source, after=after_playing)
-                        set_current_playing_song(interaction.guild_id, song_info)
-
-                        playing_embed = create_playing_embed(song_info)
-                        view = PlayingView(interaction.message, song_info)
-                        await interaction.message.edit(embed=playing_embed, view=view)
-
-                    search_lock = get_search_lock(interaction.guild_id)
-                    search_lock.is_locked = False
-                    search_lock.current_user = None
+                            playing_embed = create_playing_embed(current_song, interaction.guild_id)
+                            await self.message.edit(embed=playing_embed, view=PlayingView(self.message, current_song))
 
                 except Exception as e:
                     error_embed = nextcord.Embed(
@@ -1349,11 +3050,7 @@ class SongSelectView(View):
                         description=str(e),
                         color=nextcord.Color.red()
                     )
-                    await interaction.message.edit(embed=error_embed, view=PlayingView(interaction.message))
-
-                    search_lock = get_search_lock(interaction.guild_id)
-                    search_lock.is_locked = False
-                    search_lock.current_user = None
+                    await interaction.edit_original_message(embed=error_embed)
 
             except nextcord.NotFound:
                 # 상호작용이 만료된 경우
@@ -1399,22 +3096,18 @@ class InitialView(View):
 
     @nextcord.ui.button(label="노래 검색", style=nextcord.ButtonStyle.primary)
     async def search_button(self, button: nextcord.ui.Button, interaction: nextcord.Interaction):
-        search_lock = get_search_lock(interaction.guild_id)
-        if search_lock.is_locked:
-            if search_lock.current_user != interaction.user:
-                await interaction.response.send_message(
-                    f"❌ {search_lock.current_user.name}의 검색이 진행 중이야..! 잠시만 기다려줘!", 
-                    ephemeral=True
-                )
-                return
-        
-        search_lock.is_locked = True
-        search_lock.current_user = interaction.user
-        
-        modal = SearchModal(interaction.message, self)
+        search = search_sessions.begin(interaction.guild_id, interaction.user.id, SEARCH_MODAL_TIMEOUT)
+        if not search:
+            await interaction.response.send_message(
+                "❌ 지금 검색 중인 사람이 너무 많아..! 잠시만 기다려줘!",
+                ephemeral=True
+            )
+            return
+
+        modal = SearchModal(interaction.message, self, search)
         await interaction.response.send_modal(modal)
 
-def create_playing_embed(song_info):
+def create_playing_embed(song_info, guild_id: int = None):
     embed = nextcord.Embed(
         title="🎵 현재 재생 중",
         color=nextcord.Color.green()
@@ -1437,78 +3130,53 @@ def create_playing_embed(song_info):
         value=song_info.get('channel', 'N/A'),
         inline=True
     )
+
+    queue_length = db.get_queue_length(guild_id) if guild_id else 0
+    if queue_length:
+        embed.add_field(
+            name="재생목록",
+            value=f"{queue_length}곡 | 총 {format_duration(db.get_queue_duration(guild_id))}",
+            inline=True
+        )
     
     if song_info.get('thumbnail'):
         embed.set_thumbnail(url=song_info['thumbnail'])
     
     return embed
 
-async def play_next(guild_id, message):
-    lock = await play_manager.get_lock(guild_id)
-    async with lock:
-        try:
-            next_song = db.get_next_song(guild_id)
-            current_song = get_current_playing_song(guild_id)
-            
-            if get_repeat_state(guild_id) and current_song:
-                db.add_to_queue(guild_id, current_song)
-                if get_shuffle_state(guild_id):
-                    db.shuffle_queue(guild_id)
-
-            if next_song:
-                voice_client = message.guild.voice_client
-                if not voice_client or not voice_client.is_connected():
-                    return
-
-                try:
-                    source = await get_audio_source(next_song['url'], guild_id)
-                    
-                    def after_playing(error):
-                        if error:
-                            print(f"Error playing next song: {error}")
-                        asyncio.run_coroutine_threadsafe(
-                            play_next(guild_id, message),
-                            bot.loop
-                        )
-
-                    voice_client.play(source, after=after_playing)
-                    set_current_playing_song(guild_id, next_song)
-
-                    playing_embed = create_playing_embed(next_song)
-                    view = PlayingView(message, next_song)
-                    await message.edit(embed=playing_embed, view=view)
-                    
-                    # 음성 채널 타이머 시작
-                    voice_state = get_voice_state(guild_id)
-                    await voice_state.start_timer(voice_client, message)
-
-                except Exception as e:
-                    print(f"Error in play_next: {e}")
-                    await play_next(guild_id, message)  # 오류 발생 시 다음 곡 시도
-            else:
-                if get_repeat_state(guild_id) and current_song:
-                    db.add_to_queue(guild_id, current_song)
-                    await play_next(guild_id, message)
-                    return
-                    
-                voice_client = message.guild.voice_client
-                if voice_client:
-                    await get_voice_state(guild_id).handle_disconnect(voice_client, message)
-                
-                current_playing.pop(guild_id, None)
-                db.clear_guild_queue(guild_id)
-
-        except Exception as e:
-            print(f"Error in play_next: {e}")
-            await handle_play_error(guild_id, message)
+def create_queued_embed(song_info, position: int):
+    """재생 중인 곡이 있어서 재생목록에 들어간 곡 안내"""
+    queue_embed = nextcord.Embed(
+        title="🎵 재생목록에 추가",
+        color=nextcord.Color.blue()
+    )
+    queue_embed.add_field(name="제목", value=song_info['title'], inline=False)
+    queue_embed.add_field(name="재생목록 위치", value=f"{position}번째", inline=True)
+    if song_info['thumbnail']:
+        queue_embed.set_thumbnail(url=song_info['thumbnail'])
+    return queue_embed
+
+async def restore_player_message(guild_id: int, message):
+    """플레이어 메시지를 지금 상태(재생 중인 곡 또는 처음 화면)로 되돌림"""
+    current_song = get_current_playing_song(guild_id)
+    voice_client = message.guild.voice_client
+    if current_song and voice_client and (voice_client.is_playing() or voice_client.is_paused()):
+        playing_embed = create_playing_embed(current_song, guild_id)
+        await message.edit(embed=playing_embed, view=PlayingView(message, current_song))
+    else:
+        initial_embed = nextcord.Embed(
+            title="🎵 노래 부르는 미루",
+            description="아래 버튼을 눌러서 미루에게 음악을 검색해봐!",
+            color=nextcord.Color.blue()
+        )
+        await message.edit(embed=initial_embed, view=InitialView(message))
 
 async def handle_play_error(guild_id: int, message):
     """재생 오류 처리 함수"""
     try:
         # 상태 초기화
-        current_playing.pop(guild_id, None)
-        repeat_states.pop(guild_id, None)
-        shuffle_states.pop(guild_id, None)
+        clear_current_playing_song(guild_id)
+        reset_playback_modes(guild_id)
         
         try:
             db.clear_guild_queue(guild_id)
@@ -1519,6 +3187,7 @@ async def handle_play_error(guild_id: int, message):
         try:
             voice_client = message.guild.voice_client
             if voice_client and voice_client.is_connected():
+                mark_stop_requested(guild_id)
                 await voice_client.disconnect()
         except Exception as e:
             print(f"Error disconnecting voice client: {e}")
@@ -1562,6 +3231,29 @@ class ErrorHandler:
         except Exception as e:
             print(f"Error handler failed: {e}")
 
+@bot.slash_command(name="이동", description="지금 재생 중인 노래를 원하는 위치로 옮길 수 있어!")
+async def seek_command(interaction: nextcord.Interaction, position: str = SlashOption(name="시간", description="이동할 위치를 알려줘! (예: 1:23, 90, +30, -10)", required=True)):
+    voice_client = interaction.guild.voice_client
+    if not voice_client or not interaction.user.voice or voice_client.channel != interaction.user.voice.channel:
+        await interaction.response.send_message("❌ 미루랑 같은 음성 채널에 있어야 해..!", ephemeral=True)
+        return
+
+    text = position.strip()
+    if text and text[0] in '+-':
+        delta = parse_duration(text[1:])
+        target = None
+        if delta is not None:
+            current = get_playback_position(interaction.guild_id)
+            target = current + delta if text[0] == '+' else current - delta
+    else:
+        target = parse_duration(text)
+
+    if target is None:
+        await interaction.response.send_message("❌ 시간은 1:23이나 90처럼 입력해줘!", ephemeral=True)
+        return
+
+    await seek_and_respond(interaction, target)
+
 @bot.slash_command(name="음악채널", description="음악 명령어를 사용할 수 있는 채널을 설정할 수 있어!")
 async def set_music_channel(interaction: nextcord.Interaction, channel: nextcord.TextChannel = SlashOption(description="음악 명령어를 사용할 채널을 선택해줘!", required=True)):
     if not interaction.user.guild_permissions.administrator:
@@ -1603,22 +3295,33 @@ class ConfirmMusicSetupView(View):
 
         await interaction.response.defer()
 
-        # 기존 메시지 제거
-        async for message in interaction.channel.history(limit=100):
-            if message.author == bot.user and message.embeds:
-                embed = message.embeds[0]
-                if embed.title in ["🎵 노래 부르는 미루", "🎵 현재 재생 중"]:
-                    try:
-                        db.remove_music_player(interaction.guild.id)
-                        await message.delete()
-                    except:
-                        pass
+        # 기존 메시지 제거 (저장된 메시지 ID로 바로 삭제, 기록이 없을 때만 채널 기록 검색)
+        record = db.get_music_player(interaction.guild.id)
+        if record:
+            channel_id, message_id = record
+            db.remove_music_player(interaction.guild.id)
+            player_message_handles.pop(interaction.guild.id, None)
+            channel = interaction.guild.get_channel(channel_id)
+            if channel:
+                try:
+                    await channel.get_partial_message(message_id).delete()
+                except nextcord.HTTPException:
+                    pass  # 이미 삭제된 메시지
+        else:
+            async for message in interaction.channel.history(limit=100):
+                if message.author == bot.user and message.embeds:
+                    embed = message.embeds[0]
+                    if embed.title in ["🎵 노래 부르는 미루", "🎵 현재 재생 중"]:
+                        try:
+                            await message.delete()
+                        except:
+                            pass
 
         # 현재 재생 여부 확인
         current_song = get_current_playing_song(interaction.guild.id)
 
         if current_song and interaction.guild.voice_client and interaction.guild.voice_client.is_playing():
-            playing_embed = create_playing_embed(current_song)
+            playing_embed = create_playing_embed(current_song, interaction.guild_id)
             msg = await interaction.followup.send(embed=playing_embed, wait=True)
             await msg.edit(view=PlayingView(msg, current_song))
         else:
@@ -1642,6 +3345,40 @@ async def ask_music_setup(interaction: nextcord.Interaction):
         ephemeral=True
     )
 
+@bot.slash_command(name="성능", description="미루의 이벤트 루프 상태를 확인할 수 있어! (관리자 전용)")
+async def show_loop_metrics(interaction: nextcord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ 이 명령어는 관리자만 사용할 수 있어!", ephemeral=True)
+        return
+
+    stats = loop_monitor.snapshot()
+    embed = nextcord.Embed(
+        title="📊 이벤트 루프 상태",
+        description=f"최근 {stats['samples']}개 샘플 기준이야!",
+        color=nextcord.Color.blue()
+    )
+    embed.add_field(name="지연 p50", value=f"{stats['p50_ms']}ms", inline=True)
+    embed.add_field(name="지연 p99", value=f"{stats['p99_ms']}ms", inline=True)
+    embed.add_field(name="최대 지연", value=f"{stats['max_ms']}ms", inline=True)
+    embed.add_field(
+        name=f"느린 콜백 ({stats['threshold_ms']}ms 이상)",
+        value=f"{stats['slow_callbacks']}회",
+        inline=False
+    )
+    for event in list(loop_monitor.slow_callbacks)[-3:]:
+        embed.add_field(
+            name=f"{event['at']} · {event['blocked_ms']}ms",
+            value=f"`{event['coroutine'][:200]}`",
+            inline=False
+        )
+
+    dump = json.dumps(loop_monitor.dump(), ensure_ascii=False, indent=2)
+    await interaction.response.send_message(
+        embed=embed,
+        file=nextcord.File(io.BytesIO(dump.encode('utf-8')), filename="loop_metrics.json"),
+        ephemeral=True
+    )
+
 @bot.event
 async def on_ready():
     # 유저 인스톨톨
@@ -1657,15 +3394,26 @@ async def on_ready():
         item['contexts'] = context_types
         item['integration_types'] = integration_types
 
-    data = await bot.http.bulk_upsert_global_commands(bot.application_id, payload=default_payload)
+    # 클러스터 모드에서는 0번 워커만 명령어를 등록
+    if not CLUSTER_ID or CLUSTER_ID == "0":
+        data = await bot.http.bulk_upsert_global_commands(bot.application_id, payload=default_payload)
 
-    print (data)
+        print (data)
 
     # 봇 로그인
     print(f'Logged in as {bot.user}')
     
-    # 캐시 클린업 태스크 시작
-    bot.loop.create_task(cleanup_guild_caches())
+    # 세션 클린업 태스크 시작
+    bot.loop.create_task(cleanup_guild_sessions())
+
+    # 이벤트 루프 모니터 시작
+    loop_monitor.start(bot.loop)
+
+    # 메트릭 엔드포인트 시작
+    try:
+        await metrics.start_server(METRICS_HOST, METRICS_PORT)
+    except OSError as e:
+        print(f"Failed to start metrics endpoint: {e}")
 
     #상태표시
     await bot.change_presence(activity=nextcord.Activity(type=nextcord.ActivityType.listening, name="졸린 미루가 음악"), status=nextcord.Status.online)
@@ -1673,6 +3421,21 @@ async def on_ready():
     # 저장된 음악 플레이어 복구
     await restore_music_players()
 
+    # 클러스터 슈퍼바이저에 준비 완료 알림
+    if cluster:
+        if not cluster.connected:
+            await cluster.connect(on_shutdown=bot.close)
+            bot.loop.create_task(cluster.heartbeat_loop(get_cluster_stats))
+        await cluster.notify_ready()
+
+def get_cluster_stats() -> dict:
+    """슈퍼바이저에 보내는 워커 상태"""
+    return {
+        'guilds': len(bot.guilds),
+        'voice_clients': len(bot.voice_clients),
+        'latency': round(bot.latency * 1000, 1)
+    }
+
 async def restore_music_players():
     """저장된 음악 플레이어 메시지 복구"""
     try:
@@ -1681,6 +3444,9 @@ async def restore_music_players():
         failed_count = 0
         
         for guild_id, channel_id, message_id in players:
+            # 다른 워커가 맡은 서버는 건드리지 않음
+            if not owns_guild(guild_id):
+                continue
             try:
                 channel = bot.get_channel(channel_id)
                 if not channel:
@@ -1693,17 +3459,7 @@ async def restore_music_players():
                     message = await channel.fetch_message(message_id)
                     if message:
                         # 메시지가 존재하면 현재 재생 중인 노래 확인
-                        current_song = get_current_playing_song(guild_id)
-                        if current_song and message.guild.voice_client and message.guild.voice_client.is_playing():
-                            playing_embed = create_playing_embed(current_song)
-                            await message.edit(embed=playing_embed, view=PlayingView(message, current_song))
-                        else:
-                            initial_embed = nextcord.Embed(
-                                title="🎵 노래 부르는 미루",
-                                description="아래 버튼을 눌러서 미루에게 음악을 검색해봐!",
-                                color=nextcord.Color.blue()
-                            )
-                            await message.edit(embed=initial_embed, view=InitialView(message))
+                        await restore_player_message(guild_id, message)
                         restored_count += 1
                 except nextcord.NotFound:
                     db.remove_music_player(guild_id)
@@ -1741,80 +3497,362 @@ async def on_error(event, *args, **kwargs):
     if kwargs:
         print(f"Additional info: {kwargs}")
 
+VOICE_EVENT_DEBOUNCE = 2.0  # 이 시간(초) 동안 들어온 음성 이벤트는 한 번만 판단
+
+def count_humans(channel) -> int:
+    return len([m for m in channel.members if not m.bot])
+
+def schedule_voice_evaluation(guild):
+    """서버별로 판단을 한 번만 예약 (이미 예약돼 있으면 무시)"""
+    session = get_session(guild.id)
+    if session.voice_eval_handle:
+        return
+    session.voice_eval_handle = bot.loop.call_later(
+        VOICE_EVENT_DEBOUNCE, evaluate_voice_channel, guild
+    )
+
+def evaluate_voice_channel(guild):
+    session = guild_sessions.get(guild.id)
+    if not session:
+        return
+    session.voice_eval_handle = None
+    voice_client = guild.voice_client
+    if not voice_client or not voice_client.channel:
+        session.human_count = None
+        return
+    channel_id, humans = session.human_count or (None, None)
+    if channel_id != voice_client.channel.id:
+        humans = count_humans(voice_client.channel)
+        session.human_count = (voice_client.channel.id, humans)
+    # 봇이 음성 채널에 혼자 남은 경우에만 타이머 시작
+    if humans == 0:
+        bot.loop.create_task(start_idle_timer(guild, voice_client))
+
+async def start_idle_timer(guild, voice_client):
+    message = await get_player_message(guild)
+    if message:
+        await get_voice_state(guild.id).start_timer(voice_client, message)
+
 @bot.event
 async def on_voice_state_update(member, before, after):
     """음성 채널 상태 변경 이벤트 핸들러"""
     try:
+        before_id = before.channel.id if before.channel else None
+        after_id = after.channel.id if after.channel else None
+        # 음소거, 헤드셋, 방송 켜기/끄기 같은 같은 채널 안의 변화는 무시
+        if before_id == after_id:
+            return
+
+        guild = member.guild
+        if member.id == bot.user.id:
+            # 봇이 옮겨가면 사람 수를 다시 세야 함
+            session = guild_sessions.get(guild.id)
+            if session:
+                session.human_count = None
+            if after_id:
+                schedule_voice_evaluation(guild)
+            return
         if member.bot:
             return
-            
-        guild_id = member.guild.id
-        voice_client = member.guild.voice_client
-        
-        if not voice_client:
+
+        voice_client = guild.voice_client
+        if not voice_client or not voice_client.channel:
             return
-            
-        # 봇이 음성 채널에 혼자 남은 경우 체크
-        if voice_client.channel and len([m for m in voice_client.channel.members if not m.bot]) == 0:
-            voice_state = get_voice_state(guild_id)
-            # 타이머 시작
-            message = await get_player_message(member.guild)
-            if message:
-                await voice_state.start_timer(voice_client, message)
+        bot_channel_id = voice_client.channel.id
+        if bot_channel_id not in (before_id, after_id):
+            return
+
+        session = get_session(guild.id)
+        if session.human_count and session.human_count[0] == bot_channel_id:
+            delta = 1 if after_id == bot_channel_id else -1
+            session.human_count = (bot_channel_id, max(0, session.human_count[1] + delta))
+        schedule_voice_evaluation(guild)
     except Exception as e:
         print(f"Error in voice state update: {e}")
 
+# guild_id -> PartialMessage (플레이어 메시지 핸들, API 호출 없이 edit 가능)
+player_message_handles = {}
+
 async def get_player_message(guild):
     try:
-        channel_id = db.get_music_channel(guild.id)
-        if not channel_id:
+        record = db.get_music_player(guild.id)
+        if not record:
+            player_message_handles.pop(guild.id, None)
             return None
-            
+
+        channel_id, message_id = record
+        handle = player_message_handles.get(guild.id)
+        if handle and handle.id == message_id and handle.channel.id == channel_id:
+            return handle
+
         channel = guild.get_channel(channel_id)
         if not channel:
             return None
-            
-        players = db.get_music_players()
-        for _, c_id, m_id in players:
-            if c_id == channel_id:
-                try:
-                    return await channel.fetch_message(m_id)
-                except:
-                    continue
-        return None
+        handle = player_message_handles[guild.id] = channel.get_partial_message(message_id)
+        return handle
     except Exception as e:
         print(f"Error getting player message: {e}")
         return None
 
 # GPT
-@bot.event
-async def on_message(message: nextcord.Message):
-    if message.content.startswith("미루야"):
-        question = message.content[len("미루야"):].strip()
+def normalize_prompt(text: str) -> str:
+    """캐시 키용 질문 정규화 (대소문자, 띄어쓰기, 문장부호 무시)"""
+    text = unicodedata.normalize('NFKC', text).lower()
+    return re.sub(r'[\W_]+', '', text)
+
+def estimate_tokens(text: str) -> int:
+    """토큰 수 대략 계산 (한글은 글자당 1토큰 정도)"""
+    return len(text.encode('utf-8')) // 3 + 1
+
+class ChatHistory:
+    """채널별 대화 맥락 (토큰 예산을 넘으면 오래된 대화는 요약으로 대체)"""
+    __slots__ = ('turns', 'tokens', 'summary', 'pending', 'summarizing')
 
+    def __init__(self):
+        self.turns = collections.deque()  # (role, content, tokens)
+        self.tokens = 0
+        self.summary = ''
+        self.pending = []  # 요약을 기다리는 오래된 대화
+        self.summarizing = False
+
+    def is_empty(self) -> bool:
+        return not self.turns and not self.summary
+
+    def fingerprint(self) -> str:
+        """답변 캐시 키용 맥락 요약 (직전 질문/답변 한 쌍, 맥락이 없으면 빈 문자열)"""
+        recent = [normalize_prompt(content) for _, content, _ in list(self.turns)[-2:]]
+        if not recent and not self.summary:
+            return ''
+        recent = '\x00'.join(recent or [self.summary])
+        return hashlib.blake2b(recent.encode('utf-8'), digest_size=8).hexdigest()
+
+    def add(self, role: str, content: str):
+        tokens = estimate_tokens(content)
+        self.turns.append((role, content, tokens))
+        self.tokens += tokens
+        # 최근 한 쌍(질문+답변)은 항상 남겨둠
+        while self.tokens > GPT_HISTORY_TOKEN_BUDGET and len(self.turns) > 2:
+            old_role, old_content, old_tokens = self.turns.popleft()
+            self.tokens -= old_tokens
+            self.pending.append((old_role, old_content))
+
+    def build_messages(self, question: str) -> list:
+        messages = [{"role": "system", "content": GPT_SYSTEM_PROMPT}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"지금까지의 대화 요약: {self.summary}"})
+        messages.extend({"role": role, "content": content} for role, content, _ in self.turns)
+        messages.append({"role": "user", "content": question})
+        return messages
+
+class GPTChat:
+    """미루야 채팅 (비동기 스트리밍 + 동시성/유저별 제한 + 답변 캐시/대화 맥락)"""
+    def __init__(self, client):
+        self.client = client
+        self.semaphore = asyncio.Semaphore(GPT_MAX_CONCURRENCY)
+        self.user_requests = cachetools.TTLCache(maxsize=10000, ttl=GPT_USER_RATE_WINDOW)
+        self.response_cache = cachetools.TTLCache(maxsize=GPT_CACHE_SIZE, ttl=GPT_CACHE_TTL)
+        self.histories = cachetools.TTLCache(maxsize=GPT_HISTORY_CHANNELS, ttl=GPT_HISTORY_TTL)
+
+    def check_rate_limit(self, user_id: int) -> float:
+        """허용되면 0, 아니면 다시 시도할 수 있을 때까지 남은 시간(초)"""
+        now = time.monotonic()
+        history = self.user_requests.get(user_id) or collections.deque()
+        while history and now - history[0] > GPT_USER_RATE_WINDOW:
+            history.popleft()
+        if len(history) >= GPT_USER_RATE_LIMIT:
+            return GPT_USER_RATE_WINDOW - (now - history[0])
+        history.append(now)
+        self.user_requests[user_id] = history
+        return 0
+
+    def get_history(self, channel_id: int) -> ChatHistory:
+        history = self.histories.get(channel_id)
+        if history is None:
+            history = ChatHistory()
+        # 다시 넣어서 만료 시간 갱신
+        self.histories[channel_id] = history
+        return history
+
+    def remember(self, history: ChatHistory, question: str, answer: str):
+        history.add("user", question)
+        history.add("assistant", answer)
+        if history.pending and not history.summarizing:
+            history.summarizing = True
+            asyncio.create_task(self.summarize(history))
+
+    async def summarize(self, history: ChatHistory):
+        """밀려난 대화를 이전 요약과 합쳐서 짧게 요약"""
         try:
-            completion = openai.chat.completions.create(
-                model="gpt-4.1-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "당신의 이름은 '미루'이고 나이는 '18'살 '여고생'입니다. 답변을 반말로 하고 답변에 애교를 최대한 많이 섞어주세요. 만약 당신을 누가 만들었는지 물어본다면 hyexn이라는 분이 만들었다고 대답해주세요. 만약 어떤 모델을 사용하는지 물어본다면 OpenAI의의 GPT-4.1 mini를 사용하고 있다고 대답해주세요. 언제 태어났냐고 물어본다면 2008년 05월 10일 이라고 대답하세요."
-                    },
-                    {"role": "user", "content": question}
-                ],
-                max_tokens=2000
-            )
+            while history.pending:
+                dropped, history.pending = history.pending, []
+                transcript = '\n'.join(f"{role}: {content}" for role, content in dropped)
+                async with self.semaphore:
+                    completion = await self.client.chat.completions.create(
+                        model=GPT_MODEL,
+                        messages=[
+                            {"role": "system", "content": "이전 요약과 이어지는 대화를 합쳐서 핵심만 3문장 이내로 요약해줘."},
+                            {"role": "user", "content": f"이전 요약: {history.summary or '없음'}\n\n대화:\n{transcript}"}
+                        ],
+                        max_tokens=GPT_SUMMARY_MAX_TOKENS
+                    )
+                history.summary = completion.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"GPT summary error: {e}")
+        finally:
+            history.summarizing = False
+
+    async def reply(self, message: nextcord.Message, question: str):
+        history = self.get_history(message.channel.id)
+        # 같은 질문이라도 직전 대화가 다르면 다른 답이 나와야 하므로 맥락도 키에 넣음
+        # (문장부호만 있는 질문처럼 정규화하면 빈 문자열이 되는 건 캐시하지 않음)
+        question_key = normalize_prompt(question)
+        cache_key = (question_key, history.fingerprint()) if question_key else None
+
+        if cache_key:
+            cached = self.response_cache.get(cache_key)
+            CACHE_REQUESTS.inc(cache='gpt_response', result='hit' if cached else 'miss')
+            if cached:
+                for chunk in [cached[i:i + 2000] for i in range(0, len(cached), 2000)]:
+                    await message.reply(chunk)
+                self.remember(history, question, cached)
+                return cached
+
+        retry_after = self.check_rate_limit(message.author.id)
+        if retry_after:
+            await message.reply(f"잠깐잠깐~ 너무 빨라! {int(retry_after) + 1}초 뒤에 다시 물어봐줘! 💦")
+            return
 
-            response = completion.choices[0].message.content.strip()
-            for chunk in [response[i:i + 2000] for i in range(0, len(response), 2000)]:
-                await message.reply(chunk)
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), timeout=GPT_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            await message.reply("으앙 지금 질문이 너무 많아서 머리가 핑핑 돌아... 조금 있다가 다시 물어봐줘! 🥺")
+            return
 
+        try:
+            messages = history.build_messages(question)
+            answer = await asyncio.wait_for(self.stream_reply(message, messages), timeout=GPT_TIMEOUT)
+            if answer:
+                if cache_key:
+                    self.response_cache[cache_key] = answer
+                self.remember(history, question, answer)
+            return answer
+        except asyncio.TimeoutError:
+            print(f"GPT timeout for user {message.author.id}")
+            await message.reply("미루가 생각하다가 잠들어버렸나봐... 다시 한 번 물어봐줄래? 😴")
         except Exception as e:
-            import traceback
             print("GPT 오류:", e)
             traceback.print_exc()
             await message.reply("앗! 이게 뭐야? 오류가 났나봐! 다시 한 번 해줄 수 있을까? 부탁해~ 💕")
+        finally:
+            self.semaphore.release()
+
+    async def stream_reply(self, message: nextcord.Message, messages: list) -> str:
+        """토큰이 도착하는 대로 답장 하나를 계속 수정 (2000자를 넘으면 다음 메시지로)"""
+        stream = await self.client.chat.completions.create(
+            model=GPT_MODEL,
+            messages=messages,
+            max_tokens=2000,
+            stream=True
+        )
+
+        full_text = ''
+        text = ''  # 현재 메시지에 들어갈 내용
+        reply_message = None
+        sent_text = ''
+        last_edit = 0.0
+
+        async def flush(content):
+            nonlocal reply_message, sent_text
+            if reply_message is None:
+                reply_message = await message.reply(content)
+            elif content != sent_text:
+                await reply_message.edit(content=content)
+            sent_text = content
+
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            full_text += delta
+            text += delta
+
+            while len(text) > 2000:
+                await flush(text[:2000])
+                text = text[2000:]
+                reply_message = None
+
+            now = time.monotonic()
+            if text.strip() and now - last_edit >= GPT_EDIT_INTERVAL:
+                await flush(text)
+                last_edit = now
+
+        if text.strip():
+            await flush(text.strip())
+        elif not full_text.strip():
+            await message.reply("음... 미루가 할 말을 까먹었어... 🥺")
+        return full_text.strip()
+
+gpt_chat = GPTChat(openai)
+
+def is_chat_enabled(guild_id: int) -> bool:
+    chat_enabled = db.get_guild_settings(guild_id).chat_enabled
+    if chat_enabled is None:
+        return not CHAT_OPT_IN
+    return bool(chat_enabled)
+
+@bot.event
+async def on_message(message: nextcord.Message):
+    # 대부분의 메시지는 여기서 바로 무시 (봇/웹훅/접두사 없음)
+    if message.author.bot or message.webhook_id or not message.content.startswith(CHAT_PREFIX):
+        return
+
+    # 접두사 명령어가 있을 때만 명령어 처리
+    rest = message.content[len(CHAT_PREFIX):]
+    if rest and not rest[0].isspace() and rest.split(maxsplit=1)[0] in bot.all_commands:
+        await bot.process_commands(message)
+        return
+
+    if message.guild and not is_chat_enabled(message.guild.id):
+        return
+
+    await gpt_chat.reply(message, rest.strip())
+
+@bot.slash_command(name="채팅", description="이 서버에서 미루야 채팅을 켜거나 끌 수 있어! (관리자 전용)")
+async def toggle_chat(interaction: nextcord.Interaction, enabled: bool = SlashOption(name="사용", description="미루야 채팅을 사용할까?", required=True)):
+    if not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ 이 명령어는 관리자만 사용할 수 있어!", ephemeral=True)
+        return
 
-    await bot.process_commands(message)
+    db.set_chat_enabled(interaction.guild_id, enabled)
+    if enabled and not MESSAGE_CONTENT_INTENT:
+        await interaction.response.send_message(
+            "⚠️ 채팅을 켰지만 지금 미루는 메시지 내용 인텐트 없이 실행 중이라 대답할 수 없어...",
+            ephemeral=True
+        )
+        return
+    await interaction.response.send_message(
+        f"💬 이 서버에서 미루야 채팅을 {'켰어!' if enabled else '껐어!'}",
+        ephemeral=True
+    )
 
-bot.run(os.getenv('DISCORD_TOKEN'))
\ No newline at end of file
+if __name__ == "__main__":
+    # python main.py export-queues FILE / import-queues FILE : 저장된 재생목록 옮기기
+    if len(sys.argv) == 3 and sys.argv[1] == 'export-queues':
+        with open(sys.argv[2], 'w', encoding='utf-8') as f:
+            print(f"Exported {db.export_saved_queues(f)} saved queues")
+        sys.exit(0)
+    if len(sys.argv) == 3 and sys.argv[1] == 'import-queues':
+        try:
+            with open(sys.argv[2], encoding='utf-8') as f:
+                imported, skipped = db.import_saved_queues(f)
+        except SavedQueueImportError as e:
+            print(f"Import failed: {e}")
+            sys.exit(1)
+        print(f"Imported {imported} saved queues, skipped {skipped} existing")
+        sys.exit(0)
+
+    # 이전 실행에서 남은 재생목록 정리
+    db.clear_all_queues()
+    bot.run(os.getenv('DISCORD_TOKEN'))
\ No newline at end of file